@@ -6,16 +6,49 @@ from pip_api._vendor.packaging_legacy.version import LegacyVersion as Version
 # Import this now because we need it below
 from pip_api._version import version
 
-PIP_VERSION: Version = packaging_version.parse(version())  # type: ignore
+# PIP_VERSION is computed lazily by __getattr__ below, since determining it
+# requires calling out to pip
+PIP_VERSION: Version
 PYTHON_VERSION = sys.version_info
 
 # Import these because they depend on the above
-from pip_api._hash import hash
-from pip_api._installed_distributions import installed_distributions
+from pip_api._pool import CallPool, call_priority, set_call_pool
+from pip_api._observers import (
+    CallRecord,
+    CallStats,
+    JSONLinesExporter,
+    add_call_observer,
+    remove_call_observer,
+)
+from pip_api._hash import HashCache, hash, hash_many
+from pip_api._installed_distributions import (
+    installed_distributions,
+    installed_distributions_many,
+    iter_installed_distributions,
+)
 
 # Import these whenever, doesn't matter
 from pip_api._parse_requirements import (
     Requirement,
+    RequirementsDiff,
+    RequirementsDocument,
     UnparsedRequirement,
+    iter_requirements,
     parse_requirements,
+    parse_requirements_for_environments,
 )
+
+
+def _pip_version(timeout=None):
+    # Memoize the result as a real module attribute, so that pip is only
+    # called the first time PIP_VERSION is needed
+    global PIP_VERSION
+    if "PIP_VERSION" not in globals():
+        PIP_VERSION = packaging_version.parse(version(timeout=timeout))  # type: ignore
+    return PIP_VERSION
+
+
+def __getattr__(name):
+    if name == "PIP_VERSION":
+        return _pip_version()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
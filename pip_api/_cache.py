@@ -0,0 +1,159 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+WINDOWS = sys.platform.startswith("win") or (sys.platform == "cli" and os.name == "nt")
+
+
+def cache_dir() -> Optional[str]:
+    """
+    Return the directory pip_api stores its caches in, or None if caching
+    has been disabled with PIPAPI_NO_CACHE_DIR.
+    """
+    if os.environ.get("PIPAPI_NO_CACHE_DIR"):
+        return None
+
+    if os.environ.get("PIPAPI_CACHE_DIR"):
+        return os.environ["PIPAPI_CACHE_DIR"]
+
+    if WINDOWS:
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+            os.path.join("~", ".cache")
+        )
+    return os.path.join(base, "pip-api")
+
+
+def load(name: str) -> Dict[str, Any]:
+    """
+    Load the JSON cache file with the given name, returning an empty cache if
+    it is missing or unreadable.
+    """
+    directory = cache_dir()
+    if directory is None:
+        return {}
+
+    try:
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return data if isinstance(data, dict) else {}
+
+
+def store(name: str, data: Dict[str, Any]) -> None:
+    """
+    Atomically replace the JSON cache file with the given name. Failing to
+    write the cache is not an error.
+    """
+    directory = cache_dir()
+    if directory is None:
+        return
+
+    # The name may include a subdirectory of the cache directory
+    path = os.path.join(directory, name)
+    directory, name = os.path.split(path)
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def touch(name: str, interval: float) -> None:
+    """
+    Record that the cache file with the given name was used, if that hasn't
+    been recorded within the last `interval` seconds.
+    """
+    directory = cache_dir()
+    if directory is None:
+        return
+
+    path = os.path.join(directory, name)
+    try:
+        if time.time() - os.stat(path).st_mtime >= interval:
+            os.utime(path)
+    except OSError:
+        pass
+
+
+def prune(subdirectory: str, max_entries: int) -> None:
+    """
+    Remove the least recently used files in the given subdirectory of the
+    cache directory, so that at most `max_entries` remain.
+    """
+    directory = cache_dir()
+    if directory is None:
+        return
+
+    directory = os.path.join(directory, subdirectory)
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    if len(entries) <= max_entries:
+        return
+
+    def mtime(entry):
+        try:
+            return entry.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    entries.sort(key=mtime)
+    for entry in entries[: len(entries) - max_entries]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            # It may have been removed by another process
+            pass
+
+
+class LRUCache:
+    """
+    A thread-safe mapping which forgets its least recently used entries once
+    there are more than `max_entries`.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
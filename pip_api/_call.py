@@ -1,18 +1,534 @@
+import atexit
+import base64
+import codecs
+import contextlib
+import functools
+import inspect
+import json
 import os
+import signal
 import subprocess
 import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from pip_api import _observers, _pool, _worker
+from pip_api.exceptions import Incompatible, InvalidArguments, PipError, PipTimeout
 
-def call(*args, cwd=None):
-    python_location = os.environ.get("PIPAPI_PYTHON_LOCATION", sys.executable)
-    env = {
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+# How much of pip's output to read at a time, unless it's being streamed a
+# line at a time
+READ_SIZE = 65536
+
+# Environment variables which cap the resources of each pip process
+RESOURCE_LIMITS = {
+    "RLIMIT_AS": "PIPAPI_MAX_MEMORY",
+    "RLIMIT_CPU": "PIPAPI_MAX_CPU_TIME",
+}
+
+# How many commands a worker runs before it's replaced with a fresh one
+DEFAULT_WORKER_MAX_CALLS = 100
+
+# Environment variables which decide a worker's sys.path once it's started
+WORKER_STARTUP_VARIABLES = (
+    "PYTHONPATH",
+    "PYTHONHOME",
+    "PYTHONNOUSERSITE",
+    "PYTHONUSERBASE",
+    "PYTHONSAFEPATH",
+    "PYTHONPLATLIBDIR",
+)
+
+# Run by this interpreter with the limits and pip's command line, to apply the
+# limits before becoming pip. A `preexec_fn` would do this in the forked child,
+# which isn't safe in a threaded program
+LIMITS_SCRIPT = """
+import json, os, sys
+{}
+set_resource_limits(json.loads(sys.argv[1]))
+os.execvp(sys.argv[2], sys.argv[2:])
+"""
+
+
+def get_python_location(python_location: Optional[str] = None) -> str:
+    if python_location is not None:
+        return str(python_location)
+    return os.environ.get("PIPAPI_PYTHON_LOCATION", sys.executable)
+
+
+def command(args, python_location=None) -> List[str]:
+    return [get_python_location(python_location), "-m", "pip"] + [
+        str(arg) for arg in args
+    ]
+
+
+def environment() -> Dict[str, str]:
+    return {
         **os.environ,
         "PIP_YES": "true",
         "PIP_DISABLE_PIP_VERSION_CHECK": "true",
         # See https://github.com/di/pip-api/issues/239
         "PYTHONIOENCODING": "utf8",
     }
-    result = subprocess.check_output(
-        [python_location, "-m", "pip"] + list(args), cwd=cwd, env=env
+
+
+def resource_limits() -> Dict[str, int]:
+    limits = {}
+    for name, variable in RESOURCE_LIMITS.items():
+        value = os.environ.get(variable)
+        if value:
+            try:
+                limits[name] = int(value)
+            except ValueError:
+                raise InvalidArguments(
+                    "{} must be an integer, not {!r}".format(variable, value)
+                )
+
+    if limits and resource is None:
+        raise Incompatible("Resource limits are not supported on this platform")
+
+    return limits
+
+
+def limited(cmd: List[str]) -> List[str]:
+    # The command to run `cmd` with any resource limits applied to it
+    limits = resource_limits()
+    if not limits:
+        return cmd
+
+    script = LIMITS_SCRIPT.format(inspect.getsource(_worker.set_resource_limits))
+    return [sys.executable, "-c", script, json.dumps(limits)] + cmd
+
+
+def popen_kwargs() -> Dict[str, Any]:
+    # Start pip in its own process group, so that it can be killed along with
+    # anything it starts
+    kwargs: Dict[str, Any] = {}
+    if os.name == "posix":
+        kwargs["start_new_session"] = True
+
+    return kwargs
+
+
+def kill(process) -> None:
+    # Kill a process started with `popen_kwargs`, and its process group
+    if process.returncode is not None:
+        return
+
+    if os.name == "posix":
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+
+class _Deadline:
+    """
+    Kills a process started with `popen_kwargs`, and its process group, if
+    it's still running after `timeout` seconds.
+    """
+
+    def __init__(self, process, timeout: Optional[float]):
+        self.expired = False
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._expire, (process,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self, process):
+        self.expired = True
+        kill(process)
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class _WorkerUnavailable(Exception):
+    pass
+
+
+class _Worker:
+    """
+    A persistent process which runs pip commands for a single interpreter.
+    See `pip_api._worker` for the other end.
+    """
+
+    def __init__(self, python_location: str):
+        self.python_location = python_location
+        self.lock = threading.Lock()
+        self.process: Optional[subprocess.Popen] = None
+        self.calls = 0
+        # What the running worker was started with, see `_startup`
+        self.startup: Optional[Tuple] = None
+        # Set to what the worker was started with if it couldn't be started,
+        # e.g. with a very old pip
+        self.unavailable: Optional[Tuple] = None
+
+    def _start(self, startup: Tuple):
+        try:
+            source = inspect.getsource(_worker)
+            self.process = subprocess.Popen(
+                [self.python_location, "-c", source],
+                cwd=startup[0],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=environment(),
+                start_new_session=os.name == "posix",
+            )
+        except OSError as e:
+            self.unavailable = startup
+            raise _WorkerUnavailable(str(e))
+        self.calls = 0
+        self.startup = startup
+
+        message = _worker.read_message(self.process.stdout)
+        if message is None or not message.get("ready"):
+            self.stop()
+            self.unavailable = startup
+            raise _WorkerUnavailable(message and message.get("error"))
+
+    def stop(self):
+        if self.process is not None:
+            # The worker exits once it sees the end of its input
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+
+    def call(
+        self, args, cwd=None, timeout=None
+    ) -> Tuple[int, bytes, Optional[Dict[str, float]]]:
+        # Start a new worker if this is the first call, the last worker has
+        # exited, or it was started with a different sys.path than `python -m
+        # pip` would now have
+        max_calls = _worker_max_calls()
+        startup = _startup(cwd)
+        if (
+            self.process is None
+            or self.process.poll() is not None
+            or self.startup != startup
+        ):
+            self.stop()
+            self._start(startup)
+
+        request = {
+            "args": [str(arg) for arg in args],
+            # The worker was started in the (absolute) directory to run in, so
+            # a relative `cwd` mustn't be applied again
+            "cwd": startup[0],
+            "env": environment(),
+            "limits": resource_limits(),
+        }
+
+        # The worker shares its process group with the children it runs
+        # commands in, so on timeout, kill the lot and start a new worker
+        # next time
+        deadline = _Deadline(self.process, timeout)
+        try:
+            _worker.write_message(self.process.stdin, request)
+            response = _worker.read_message(self.process.stdout)
+        except OSError:
+            response = None
+        except BaseException:
+            # We won't read the response, so the worker can't be reused
+            kill(self.process)
+            self.stop()
+            raise
+        finally:
+            deadline.cancel()
+
+        if response is None:
+            self.stop()
+            if deadline.expired:
+                raise PipTimeout(command(args, self.python_location), timeout)
+            raise PipError("The pip worker process exited unexpectedly")
+
+        self.calls += 1
+        if self.calls >= max_calls:
+            self.stop()
+
+        return (
+            response["returncode"],
+            base64.b64decode(response["output"]),
+            response.get("usage"),
+        )
+
+
+# Workers, keyed by interpreter
+_workers: Dict[str, _Worker] = {}
+_workers_lock = threading.Lock()
+
+
+def _startup(cwd=None) -> Tuple:
+    # Everything which decides the sys.path of `python -m pip`, which for a
+    # worker is fixed once it's started: relative entries in PYTHONPATH are
+    # relative to the working directory
+    directory = os.path.abspath(os.fspath(cwd)) if cwd is not None else os.getcwd()
+    return (directory,) + tuple(
+        os.environ.get(variable) for variable in WORKER_STARTUP_VARIABLES
+    )
+
+
+def _worker_enabled() -> bool:
+    value = os.environ.get("PIPAPI_WORKER", "").lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("", "0", "false", "no"):
+        return False
+
+    raise InvalidArguments(
+        "PIPAPI_WORKER must be one of 1, true, yes, 0, false or no, "
+        "not {!r}".format(os.environ["PIPAPI_WORKER"])
+    )
+
+
+def _worker_max_calls() -> int:
+    value = os.environ.get("PIPAPI_WORKER_MAX_CALLS")
+    if not value:
+        return DEFAULT_WORKER_MAX_CALLS
+
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidArguments(
+            "PIPAPI_WORKER_MAX_CALLS must be an integer, not {!r}".format(value)
+        )
+
+
+def _worker_call(args, cwd=None, python_location=None, timeout=None) -> Optional[str]:
+    # Run pip in the persistent worker for the interpreter, returning None if
+    # it's unavailable or already busy
+    location = get_python_location(python_location)
+
+    with _workers_lock:
+        worker = _workers.get(location)
+        if worker is None:
+            worker = _workers[location] = _Worker(location)
+
+    if worker.unavailable == _startup(cwd) or not worker.lock.acquire(blocking=False):
+        return None
+
+    observers = _observers.get_call_observers()
+    if observers:
+        start, started = time.time(), time.perf_counter()
+
+    try:
+        returncode, output, usage = worker.call(args, cwd, timeout)
+    except _WorkerUnavailable:
+        return None
+    except PipTimeout as e:
+        if observers:
+            record(observers, e.cmd, cwd, start, started, None, 0, worker=True)
+        raise
+    finally:
+        worker.lock.release()
+
+    cmd = command(args, python_location)
+    if observers:
+        record(
+            observers, cmd, cwd, start, started, returncode, len(output), usage, True
+        )
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, output=output)
+
+    return output.decode()
+
+
+@atexit.register
+def _stop_workers():
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+
+    for worker in workers:
+        with worker.lock:
+            worker.stop()
+
+
+def record(
+    observers,
+    cmd,
+    cwd,
+    start: float,
+    started: float,
+    returncode: Optional[int],
+    output_bytes: int,
+    usage: Optional[Dict[str, float]] = None,
+    worker: bool = False,
+) -> None:
+    # Tell observers about a call which started at `start` (a timestamp) and
+    # `started` (a `time.perf_counter` reading) and has just ended
+    end = start + (time.perf_counter() - started)
+    _observers.notify(
+        observers,
+        _observers.CallRecord(
+            cmd,
+            None if cwd is None else os.fspath(cwd),
+            start,
+            end,
+            returncode,
+            output_bytes,
+            usage,
+            worker,
+        ),
+    )
+
+
+def _wait(process, observed: bool) -> Optional[Dict[str, float]]:
+    # Wait for pip to exit, reaping it ourselves to get its resource usage if
+    # anyone is observing
+    if process.returncode is None and observed and hasattr(os, "wait4"):
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # It's already been reaped, e.g. by `Popen.kill`
+            pass
+        else:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return _worker.usage(rusage)
+
+    process.wait()
+    return None
+
+
+def _output(cmd, cwd, timeout, chunk_size) -> Iterator[bytes]:
+    # Run pip, yielding its output as it's read: a line at a time, or in
+    # chunks of at most `chunk_size` bytes. If pip times out, or we're
+    # interrupted or closed early, kill anything pip has started too
+    observers = _observers.get_call_observers()
+    if observers:
+        start, started = time.time(), time.perf_counter()
+
+    process = subprocess.Popen(
+        limited(cmd),
+        cwd=cwd,
+        env=environment(),
+        stdout=subprocess.PIPE,
+        **popen_kwargs(),
     )
-    return result.decode()
+    deadline = _Deadline(process, timeout)
+    output_bytes = 0
+    usage = None
+
+    try:
+        if chunk_size is None:
+            chunks = iter(process.stdout.readline, b"")
+        else:
+            chunks = iter(functools.partial(process.stdout.read1, chunk_size), b"")
+
+        for chunk in chunks:
+            output_bytes += len(chunk)
+            yield chunk
+
+        usage = _wait(process, bool(observers))
+    finally:
+        deadline.cancel()
+        if process.returncode is None:
+            kill(process)
+            usage = _wait(process, bool(observers))
+        process.stdout.close()
+
+        if observers:
+            record(
+                observers,
+                cmd,
+                cwd,
+                start,
+                started,
+                process.returncode,
+                output_bytes,
+                usage,
+            )
+
+    if deadline.expired and process.returncode:
+        raise PipTimeout(cmd, timeout)
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def check_output(cmd, cwd=None, timeout=None) -> bytes:
+    # Like `subprocess.check_output`, but if pip times out or we're
+    # interrupted, kill anything pip has started too
+    chunks = []
+    try:
+        for chunk in _output(cmd, cwd, timeout, READ_SIZE):
+            chunks.append(chunk)
+    except subprocess.CalledProcessError as e:
+        e.output = b"".join(chunks)
+        raise
+
+    return b"".join(chunks)
+
+
+def call(*args, cwd=None, python_location=None, timeout=None):
+    pool = _pool.get_call_pool()
+    if pool is None:
+        return _run(args, cwd, python_location, timeout)
+
+    with pool.slot():
+        return _run(args, cwd, python_location, timeout)
+
+
+def _run(args, cwd=None, python_location=None, timeout=None):
+    if _worker_enabled():
+        result = _worker_call(
+            args, cwd=cwd, python_location=python_location, timeout=timeout
+        )
+        if result is not None:
+            return result
+
+    return check_output(
+        command(args, python_location), cwd=cwd, timeout=timeout
+    ).decode()
+
+
+def stream(
+    *args, cwd=None, python_location=None, timeout=None, chunk_size=None
+) -> Iterator[str]:
+    """
+    Run pip with the given arguments, yielding its output as it's written: a
+    line at a time, or in chunks of at most `chunk_size` bytes. The worker is
+    never used, since it only returns output once pip has exited.
+
+    pip holds a slot in the call pool until it exits, including while the
+    caller handles its output, so the caller mustn't wait on another call to
+    pip in the meantime.
+    """
+    pool = _pool.get_call_pool()
+    if pool is None:
+        yield from _stream(args, cwd, python_location, timeout, chunk_size)
+        return
+
+    with pool.slot():
+        yield from _stream(args, cwd, python_location, timeout, chunk_size)
+
+
+def _stream(args, cwd, python_location, timeout, chunk_size) -> Iterator[str]:
+    # A chunk can end partway through a character
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    chunks = _output(command(args, python_location), cwd, timeout, chunk_size)
+    with contextlib.closing(chunks):
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
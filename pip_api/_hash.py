@@ -1,19 +1,261 @@
+import concurrent.futures
+import hashlib
 import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
 
+from pip_api import _cache
 from pip_api._call import call
 from pip_api.exceptions import InvalidArguments
 
+# Read files in large chunks, so hashing is neither dominated by the overhead
+# of many small reads nor requires reading the whole file into memory
+BUFFER_SIZE = 1024 * 1024
 
-def hash(filename: os.PathLike, algorithm: str = "sha256") -> str:
-    """
-    Hash the given filename.
-    """
 
+def _check_algorithm(algorithm: str) -> None:
     if algorithm not in ["sha256", "sha384", "sha512"]:
         raise InvalidArguments("Algorithm {} not supported".format(algorithm))
 
-    result = call("hash", "--algorithm", algorithm, filename)
 
+def _parse_hash(result: str) -> str:
     # result is of the form:
     # <filename>:\n--hash=<algorithm>:<hash>\n
     return result.strip().split(":")[-1]
+
+
+def _hash_file(filename: os.PathLike, algorithms: Iterable[str]) -> Dict[str, str]:
+    # Compute the digests of the given file for each of the given algorithms
+    # in a single pass, in the same way `pip hash` does
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filename, "rb") as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            for hasher in hashers.values():
+                hasher.update(view[:size])
+
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+
+class HashCache:
+    """
+    A persistent cache of file hashes, keyed by each file's path, device,
+    inode, size and modification time. A file is only read again once any of
+    those change. The least recently used entries are evicted once there are
+    more than `max_entries`.
+    """
+
+    # How many entries can be added before checking whether any need evicting
+    EVICTION_INTERVAL = 64
+    # How stale an entry's last use can be before a hit records it again, so
+    # that most hits don't need to write to the database
+    LAST_USED_INTERVAL = 3600.0
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 100000):
+        # The cache is opt-in, so don't import sqlite3 with pip_api
+        import sqlite3
+
+        if path is None:
+            directory = _cache.cache_dir()
+            if directory is None:
+                path = ":memory:"
+            else:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, "hashes.sqlite3")
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._added = 0
+        # SQLite's own locking makes it safe for many processes to share the
+        # cache; the timeout is how long to wait for another writer
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                "path TEXT, algorithm TEXT, device INTEGER, inode INTEGER, "
+                "size INTEGER, mtime_ns INTEGER, digest TEXT, last_used REAL, "
+                "PRIMARY KEY (path, algorithm))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)"
+            )
+
+    def __repr__(self):
+        return "<HashCache(path='{}', hits={}, misses={})>".format(
+            self.path, self.hits, self.misses
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _key(stat_result: os.stat_result) -> List[int]:
+        return [
+            stat_result.st_dev,
+            stat_result.st_ino,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+        ]
+
+    def get(
+        self, path: str, stat_result: os.stat_result, algorithms: Iterable[str]
+    ) -> Dict[str, str]:
+        """
+        Return the cached digests of the given file which are still valid.
+        """
+        algorithms = list(algorithms)
+        key = self._key(stat_result)
+        now = time.time()
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT algorithm, device, inode, size, mtime_ns, digest, last_used "
+                "FROM hashes WHERE path = ? AND algorithm IN ({})".format(
+                    ", ".join("?" * len(algorithms))
+                ),
+                [path] + algorithms,
+            ).fetchall()
+            valid = [row for row in rows if list(row[1:5]) == key]
+            digests = {row[0]: row[5] for row in valid}
+            stale = [
+                (now, path, row[0])
+                for row in valid
+                if now - row[6] >= self.LAST_USED_INTERVAL
+            ]
+            if stale:
+                self._connection.executemany(
+                    "UPDATE hashes SET last_used = ? WHERE path = ? AND algorithm = ?",
+                    stale,
+                )
+            if len(digests) == len(algorithms):
+                self.hits += 1
+            else:
+                self.misses += 1
+        return digests
+
+    def set(
+        self, path: str, stat_result: os.stat_result, digests: Dict[str, str]
+    ) -> None:
+        """
+        Store the digests of the given file.
+        """
+        key = self._key(stat_result)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    [path, algorithm] + key + [digest, now]
+                    for algorithm, digest in digests.items()
+                ],
+            )
+
+            self._added += len(digests)
+            if self._added >= self.EVICTION_INTERVAL:
+                self._added = 0
+                self._connection.execute(
+                    "DELETE FROM hashes WHERE rowid IN ("
+                    "SELECT rowid FROM hashes ORDER BY last_used DESC, rowid DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    [self.max_entries],
+                )
+
+
+def _hash_file_cached(
+    filename: os.PathLike, algorithms: Sequence[str], cache: Optional[HashCache]
+) -> Dict[str, str]:
+    if cache is None:
+        return _hash_file(filename, algorithms)
+
+    path = os.path.abspath(filename)
+    before = os.stat(path)
+    digests = cache.get(path, before, algorithms)
+
+    missing = [algorithm for algorithm in algorithms if algorithm not in digests]
+    if missing:
+        computed = _hash_file(path, missing)
+        # Don't cache the result if the file changed while it was being read
+        if HashCache._key(os.stat(path)) == HashCache._key(before):
+            cache.set(path, before, computed)
+        digests.update(computed)
+
+    return {algorithm: digests[algorithm] for algorithm in algorithms}
+
+
+def hash(
+    filename: os.PathLike,
+    algorithm: str = "sha256",
+    use_subprocess: bool = False,
+    cache: Optional[HashCache] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    Hash the given filename. `timeout` only applies when calling out to pip.
+    """
+
+    _check_algorithm(algorithm)
+
+    if not use_subprocess:
+        return _hash_file_cached(filename, [algorithm], cache)[algorithm]
+
+    result = call("hash", "--algorithm", algorithm, filename, timeout=timeout)
+
+    return _parse_hash(result)
+
+
+class HashResult:
+    def __init__(self, filename: os.PathLike, hashes: Dict[str, str]):
+        self.filename = filename
+        self.hashes = hashes
+
+    def options(self) -> List[str]:
+        """
+        Return the hashes as `--hash` options for a requirements file.
+        """
+        return [
+            "--hash={}:{}".format(algorithm, digest)
+            for algorithm, digest in self.hashes.items()
+        ]
+
+    def __repr__(self):
+        return "<HashResult(filename='{}', hashes={!r})>".format(
+            self.filename, self.hashes
+        )
+
+
+def hash_many(
+    filenames: Iterable[os.PathLike],
+    algorithms: Sequence[str] = ("sha256",),
+    workers: Optional[int] = None,
+    cache: Optional[HashCache] = None,
+) -> Iterator[HashResult]:
+    """
+    Hash the given filenames with each of the given algorithms, using at most
+    `workers` threads. Results are yielded as soon as each file is hashed.
+    """
+
+    for algorithm in algorithms:
+        _check_algorithm(algorithm)
+
+    def hash_one(filename):
+        return HashResult(filename, _hash_file_cached(filename, algorithms, cache))
+
+    # hashlib releases the GIL while hashing, so threads hash in parallel
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(hash_one, filename) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+    finally:
+        # Don't keep hashing if the caller stops early or a file fails
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,10 +1,63 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import json
 import os
-from typing import Dict, List, Optional
+import re
+import stat
+import sys
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import pip_api
-from pip_api._call import call
+from pip_api import _pool
+from pip_api._cache import LRUCache
+from pip_api._call import call, check_output, get_python_location, stream
+from pip_api._parse_requirements import _url_to_path
+from pip_api._vendor.packaging.utils import canonicalize_name  # type: ignore
+from pip_api._vendor.packaging.version import InvalidVersion  # type: ignore
+from pip_api._vendor.packaging.version import Version  # type: ignore
 from pip_api._vendor.packaging_legacy.version import parse  # type: ignore
+from pip_api.exceptions import InvalidArguments
+
+# Distributions which `pip list` never reports
+STDLIB_PKGS = {"python", "wsgiref", "argparse"}
+PROJECT_NAME_RE = re.compile(
+    r"^([A-Z0-9]|[A-Z0-9][A-Z0-9._-]*[A-Z0-9])$", flags=re.IGNORECASE
+)
+
+# How many directories and interpreters the native backend remembers
+MAX_DIRECTORIES = 1024
+MAX_INTERPRETERS = 64
+
+# How much of pip's output to read at a time when streaming it
+STREAM_CHUNK_SIZE = 65536
+WHITESPACE_RE = re.compile(r"\s*")
+
+# Describe the environment of another interpreter, as `pip list` would see it
+INTERPRETER_INFO_SCRIPT = """
+import json, sys
+print(json.dumps({
+    "path": sys.path,
+    "prefix": sys.prefix,
+    "virtualenv": (
+        sys.prefix != getattr(sys, "base_prefix", sys.prefix)
+        or hasattr(sys, "real_prefix")
+    ),
+}))
+"""
 
 
 class Distribution:
@@ -40,30 +93,534 @@ class Distribution:
         )
 
 
-def installed_distributions(
-    local: bool = False, paths: List[os.PathLike] = []
+def _normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.realpath(os.path.expanduser(path)))
+
+
+class _Entry:
+    """
+    A `.dist-info`, `.egg-info` or `.egg-link` entry in a directory, as of
+    the given modification time.
+    """
+
+    def __init__(
+        self,
+        mtime_ns: int,
+        metadata: Optional[Dict[str, str]] = None,
+        direct_url: Any = None,
+        target: Optional[str] = None,
+    ):
+        self.mtime_ns = mtime_ns
+        self.metadata = metadata or {}
+        self.direct_url = direct_url
+        self.target = target
+
+        # The Distribution most recently built from this entry, and the
+        # editable project location it was built with. Callers get copies of
+        # it, so that it's never changed after it's cached.
+        self.distribution: Optional[Distribution] = None
+
+
+class _Directory:
+    """
+    The entries of a directory on the path, as of the given modification
+    time.
+    """
+
+    def __init__(self, mtime_ns: int, names: List[str], entries: Dict[str, _Entry]):
+        self.mtime_ns = mtime_ns
+        self.names = names
+        self.entries = entries
+
+
+# Directories scanned by the native backend, keyed by path, as `_Directory`
+# objects. A directory is only rescanned once its modification time changes,
+# and then only its new or changed entries are read again.
+_directories = LRUCache(MAX_DIRECTORIES)
+
+# The sys.path, prefix and virtualenv status of other interpreters, keyed by
+# interpreter, working directory and PYTHONPATH, along with the modification
+# times of the directories on that sys.path
+_interpreters = LRUCache(MAX_INTERPRETERS)
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path or ".").st_mtime_ns
+    except OSError:
+        return None
+
+
+def _interpreter_info(
+    python_location: Optional[str] = None, timeout: Optional[float] = None
+) -> Tuple[List[str], str, bool]:
+    location = get_python_location(python_location)
+    if os.path.abspath(location) == os.path.abspath(sys.executable):
+        path = list(sys.path)
+        prefix = sys.prefix
+        virtualenv = sys.prefix != sys.base_prefix or hasattr(sys, "real_prefix")
+
+        # The first entry is the directory of the running script, which
+        # `python -m pip` would never see
+        if path and not getattr(sys.flags, "safe_path", False):
+            path.pop(0)
+
+        return path, prefix, virtualenv
+
+    # Adding a `.pth` file to a directory on the path can change the path, so
+    # only reuse a previous result while those directories are unchanged
+    key = (location, os.getcwd(), os.environ.get("PYTHONPATH"))
+    cached = _interpreters.get(key)
+    if cached is not None:
+        info, mtimes = cached
+        if [_mtime_ns(p) for p in info["path"]] == mtimes:
+            return list(info["path"]), info["prefix"], info["virtualenv"]
+
+    # This runs the interpreter much as calling pip would, so it counts
+    # towards the call pool
+    pool = _pool.get_call_pool()
+    with pool.slot() if pool is not None else contextlib.nullcontext():
+        info = json.loads(
+            check_output([location, "-c", INTERPRETER_INFO_SCRIPT], timeout=timeout)
+        )
+
+    # `python -m pip` removes the current directory from the path
+    if info["path"] and info["path"][0] in ("", os.getcwd()):
+        info["path"].pop(0)
+
+    _interpreters.set(key, (info, [_mtime_ns(p) for p in info["path"]]))
+
+    return list(info["path"]), info["prefix"], info["virtualenv"]
+
+
+def _read_metadata(info_location: str) -> Dict[str, str]:
+    # Read the Name and Version headers from a distribution's metadata, which
+    # is a METADATA file for .dist-info, or a PKG-INFO file (or the .egg-info
+    # file itself) for .egg-info
+    if os.path.isdir(info_location):
+        candidates = ["METADATA", "PKG-INFO"]
+    else:
+        candidates = [""]
+
+    for candidate in candidates:
+        try:
+            with open(
+                os.path.join(info_location, candidate) if candidate else info_location,
+                encoding="utf-8",
+                errors="surrogateescape",
+            ) as f:
+                headers = {}
+                for line in f:
+                    if not line.strip():
+                        # End of the headers
+                        break
+                    key, sep, value = line.partition(":")
+                    if sep and key in ("Name", "Version") and key not in headers:
+                        headers[key] = value.strip()
+                return headers
+        except OSError:
+            continue
+
+    return {}
+
+
+def _read_entry(path: str, mtime_ns: int) -> _Entry:
+    if path.endswith(".egg-link"):
+        try:
+            with open(path) as f:
+                lines = (line.strip() for line in f)
+                target = next((line for line in lines if line), "")
+        except OSError:
+            target = ""
+        return _Entry(mtime_ns, target=target)
+
+    try:
+        with open(os.path.join(path, "direct_url.json")) as f:
+            direct_url = json.load(f)
+    except (OSError, ValueError):
+        direct_url = None
+
+    return _Entry(mtime_ns, metadata=_read_metadata(path), direct_url=direct_url)
+
+
+def _scan(location: str) -> Optional[_Directory]:
+    # Return the entries of the given directory, reusing the previous scan
+    # where nothing has changed
+    path = location or "."
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(stat_result.st_mode):
+        # pip doesn't consider the contents of e.g. a wheel on the path
+        # installed
+        return None
+
+    # A relative path means a different directory once the cwd changes
+    key = os.path.abspath(path)
+    cached = _directories.get(key)
+    if cached is not None and cached.mtime_ns == stat_result.st_mtime_ns:
+        return cached
+
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return None
+
+    entries = {}
+    for name in names:
+        if not name.lower().endswith((".dist-info", ".egg-info", ".egg-link")):
+            continue
+        entry_path = os.path.join(path, name)
+        mtime_ns = _mtime_ns(entry_path)
+        if mtime_ns is None:
+            continue
+        entry = cached.entries.get(name) if cached is not None else None
+        if entry is None or entry.mtime_ns != mtime_ns:
+            entry = _read_entry(entry_path, mtime_ns)
+        entries[name] = entry
+
+    directory = _Directory(stat_result.st_mtime_ns, names, entries)
+    _directories.set(key, directory)
+    return directory
+
+
+def _find_distributions(location: str, found: Set[str]) -> Iterator[Tuple[str, _Entry]]:
+    # Yield the info location and entry of each distribution in the given
+    # directory, skipping any whose name has already been found
+    directory = _scan(location)
+    if directory is None:
+        return
+
+    for name in directory.names:
+        entry = directory.entries.get(name)
+        if entry is None or entry.target is not None:
+            continue
+        if "Name" not in entry.metadata or "Version" not in entry.metadata:
+            continue
+        canonical_name = canonicalize_name(entry.metadata["Name"])
+        if canonical_name in found:
+            continue
+        found.add(canonical_name)
+        yield os.path.join(location, name), entry
+
+
+def _find_linked(location: str, found: Set[str]) -> Iterator[Tuple[str, _Entry]]:
+    # Yield the distributions that `.egg-link` files in the given directory
+    # point to, as legacy editable installs do
+    directory = _scan(location)
+    if directory is None:
+        return
+
+    for name in directory.names:
+        entry = directory.entries.get(name)
+        if entry is None or not entry.target:
+            continue
+        yield from _find_distributions(os.path.join(location, entry.target), found)
+
+
+def _editable_project_location(
+    name: str, info_location: str, entry: _Entry, sys_path: List[str]
+) -> Optional[str]:
+    # Determine where an editable project lives in the same way pip does: from
+    # the `direct_url.json` metadata if present, otherwise from an `.egg-link`
+    # file somewhere on `sys.path`
+    direct_url = entry.direct_url
+    if isinstance(direct_url, dict):
+        url = direct_url.get("url", "")
+        if direct_url.get("dir_info", {}).get("editable") and url.startswith("file:"):
+            return _url_to_path(url)
+        return None
+
+    egg_link = re.sub("[^A-Za-z0-9.]+", "-", name) + ".egg-link"
+    for path_item in sys_path:
+        directory = _scan(path_item)
+        if directory is not None and egg_link in directory.entries:
+            return os.path.dirname(info_location)
+
+    return None
+
+
+def _normalize_version(version: str) -> str:
+    # `pip list` reports normalized versions where possible
+    try:
+        return str(Version(version))
+    except InvalidVersion:
+        return version
+
+
+def _native_installed_distributions(
+    local: bool,
+    paths: List[os.PathLike],
+    python_location: Optional[str],
+    timeout: Optional[float] = None,
 ) -> Dict[str, Distribution]:
+    if local and paths:
+        raise InvalidArguments("Cannot combine 'paths' with 'local'")
+
+    pip_api._pip_version(timeout)
+    sys_path, prefix, virtualenv = _interpreter_info(python_location, timeout)
+    locations = [str(path) for path in paths] if paths else sys_path
+    normalized_prefix = _normalize_path(prefix)
+
+    dists = []
+    found: Set[str] = set()
+    for location in locations:
+        for found_dists in (
+            _find_distributions(location, found),
+            # This must go last, since that's how pip tie-breaks
+            _find_linked(location, found),
+        ):
+            for info_location, entry in found_dists:
+                name = entry.metadata["Name"]
+                canonical_name = canonicalize_name(name)
+                if canonical_name in STDLIB_PKGS:
+                    continue
+                if not PROJECT_NAME_RE.match(canonical_name):
+                    continue
+                if (
+                    local
+                    and virtualenv
+                    and not _normalize_path(location).startswith(normalized_prefix)
+                ):
+                    continue
+
+                editable_project_location = _editable_project_location(
+                    name, info_location, entry, sys_path
+                )
+                dist = entry.distribution
+                if (
+                    dist is None
+                    or dist.location != (os.path.dirname(info_location) or ".")
+                    or dist.editable_project_location != editable_project_location
+                ):
+                    dist = entry.distribution = Distribution(
+                        name,
+                        _normalize_version(entry.metadata["Version"]),
+                        os.path.dirname(info_location) or ".",
+                        editable_project_location,
+                    )
+                dists.append((canonical_name, copy.copy(dist)))
+
+    # `pip list` sorts distributions by their canonical name
+    return {dist.name: dist for _, dist in sorted(dists, key=lambda d: d[0])}
+
+
+def _list_args(local: bool, paths: List[os.PathLike]) -> List[str]:
     list_args = ["list", "-v", "--format=json"]
     if local:
         list_args.append("--local")
     for path in paths:
         list_args.extend(["--path", str(path)])
-    result = call(*list_args)
+    return list_args
 
-    ret = {}
 
-    # The returned JSON is an array of objects, each of which looks like this:
+def _list_distribution(raw_dist: Dict[str, Any]) -> Distribution:
+    # Each object in the returned JSON looks like this:
     # { "name": "some-package", "version": "0.0.1", "location": "/path/", ... }
     # The location key was introduced with pip 10.0.0b1, so we don't assume its
     # presence. The editable_project_location key was introduced with pip 21.3,
     # so we also don't assume its presence.
+    return Distribution(
+        raw_dist["name"],
+        raw_dist["version"],
+        raw_dist.get("location"),
+        raw_dist.get("editable_project_location"),
+    )
+
+
+def _parse_list(result: str) -> Dict[str, Distribution]:
+    ret = {}
+
+    # The returned JSON is an array of objects
     for raw_dist in json.loads(result):
-        dist = Distribution(
-            raw_dist["name"],
-            raw_dist["version"],
-            raw_dist.get("location"),
-            raw_dist.get("editable_project_location"),
-        )
+        dist = _list_distribution(raw_dist)
         ret[dist.name] = dist
 
     return ret
+
+
+def _iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """
+    Parse a JSON array from the given chunks of text, yielding each item as
+    soon as it's complete, so that the whole document is never held at once.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    exhausted = False
+    # What's expected next: "[", an item or "]", "," or "]", or an item
+    expecting = "["
+
+    while True:
+        position = WHITESPACE_RE.match(buffer, position).end()  # type: ignore
+
+        if position == len(buffer):
+            if exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            buffer, position = buffer[position:] + next(chunks, ""), 0
+            exhausted = position == len(buffer)
+            continue
+
+        char = buffer[position]
+        if expecting == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            position += 1
+            expecting = "item or ]"
+        elif char == "]" and expecting != "item":
+            return
+        elif expecting == ", or ]":
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in JSON array")
+            position += 1
+            expecting = "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                end = len(buffer)
+
+            # An item might continue in the next chunk (e.g. a number), so it
+            # isn't complete until it's followed by "," or "]"
+            following = WHITESPACE_RE.match(buffer, end).end()  # type: ignore
+            if not exhausted and (
+                following == len(buffer) or buffer[following] not in ",]"
+            ):
+                chunk = next(chunks, "")
+                buffer, position = buffer[position:] + chunk, 0
+                exhausted = not chunk
+                continue
+
+            yield item
+            position = end
+            expecting = ", or ]"
+
+
+def installed_distributions(
+    local: bool = False,
+    paths: List[os.PathLike] = [],
+    native: bool = False,
+    python_location: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Distribution]:
+    if native:
+        return _native_installed_distributions(local, paths, python_location, timeout)
+
+    # Building a `Distribution` needs pip's version, so give that the same
+    # timeout
+    pip_api._pip_version(timeout)
+    result = call(
+        *_list_args(local, paths), python_location=python_location, timeout=timeout
+    )
+
+    return _parse_list(result)
+
+
+def iter_installed_distributions(
+    local: bool = False,
+    paths: List[os.PathLike] = [],
+    python_location: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[Distribution]:
+    """
+    As `installed_distributions`, but reads the output of `pip list` as it's
+    written and yields each distribution as soon as it's parsed, rather than
+    holding all of pip's output in memory.
+    """
+    # `pip list` holds a slot in the call pool until it's finished, so find
+    # pip's version, which building a `Distribution` needs, beforehand
+    pip_api._pip_version(timeout)
+
+    with contextlib.closing(
+        stream(
+            *_list_args(local, paths),
+            python_location=python_location,
+            timeout=timeout,
+            chunk_size=STREAM_CHUNK_SIZE,
+        )
+    ) as chunks:
+        for raw_dist in _iter_json_array(chunks):
+            yield _list_distribution(raw_dist)
+
+
+class EnvironmentResult:
+    def __init__(
+        self,
+        distributions: Optional[Dict[str, Distribution]],
+        error: Optional[Exception],
+        duration: float,
+    ):
+        self.distributions = distributions
+        self.error = error
+        self.duration = duration
+
+    def __repr__(self):
+        return "<EnvironmentResult({}, duration={:.3f})>".format(
+            (
+                "error={!r}".format(self.error)
+                if self.error is not None
+                else "distributions={}".format(len(self.distributions or {}))
+            ),
+            self.duration,
+        )
+
+
+def installed_distributions_many(
+    environments: Iterable[Union[os.PathLike, str, Sequence[os.PathLike]]],
+    local: bool = False,
+    native: bool = False,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Dict[Any, EnvironmentResult]:
+    """
+    Return the installed distributions of many environments, each of which is
+    either the location of an interpreter, or a list of paths to look in with
+    the current interpreter. At most `workers` environments (by default, the
+    number of CPUs) are inspected at once, and each call out to pip is
+    given `timeout` seconds.
+    """
+
+    def inspect(environment):
+        start = time.perf_counter()
+        try:
+            if isinstance(environment, tuple):
+                distributions = installed_distributions(
+                    local=local,
+                    paths=list(environment),
+                    native=native,
+                    timeout=timeout,
+                )
+            else:
+                distributions = installed_distributions(
+                    local=local,
+                    native=native,
+                    python_location=environment,
+                    timeout=timeout,
+                )
+        except Exception as e:
+            return EnvironmentResult(None, e, time.perf_counter() - start)
+        return EnvironmentResult(distributions, None, time.perf_counter() - start)
+
+    # Lists of paths aren't hashable, so key the results by tuples instead
+    keys = [
+        env if isinstance(env, (str, os.PathLike)) else tuple(env)
+        for env in environments
+    ]
+    if not keys:
+        return {}
+
+    max_workers = min(workers or os.cpu_count() or 1, len(keys))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run each inspection in a copy of this context, so that it keeps the
+        # caller's `call_priority`
+        futures = [
+            executor.submit(contextvars.copy_context().run, inspect, key)
+            for key in keys
+        ]
+        results = [future.result() for future in futures]
+
+    return dict(zip(keys, results))
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import warnings
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple, Union
+
+
+class CallRecord:
+    """
+    A record of a single call out to pip. The resource usage of pip's process
+    is None where it isn't available, e.g. on Windows.
+    """
+
+    def __init__(
+        self,
+        argv: List[str],
+        cwd: Optional[str],
+        start: float,
+        end: float,
+        returncode: Optional[int],
+        output_bytes: int,
+        usage: Optional[Dict[str, float]] = None,
+        worker: bool = False,
+    ):
+        self.argv = argv
+        self.cwd = cwd
+        self.start = start
+        self.end = end
+        # None if pip was killed without reporting how it exited
+        self.returncode = returncode
+        self.output_bytes = output_bytes
+        self.user_time = usage["user_time"] if usage else None
+        self.system_time = usage["system_time"] if usage else None
+        # In bytes
+        self.max_rss = usage["max_rss"] if usage else None
+        self.worker = worker
+
+    def __repr__(self):
+        return "<CallRecord(argv={!r}, returncode={}, duration={:.3f})>".format(
+            self.argv, self.returncode, self.duration
+        )
+
+    @property
+    def command(self) -> str:
+        # The first argument given to pip, e.g. "install"
+        return self.argv[3] if len(self.argv) > 3 else ""
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "argv": self.argv,
+            "cwd": self.cwd,
+            "start": self.start,
+            "end": self.end,
+            "returncode": self.returncode,
+            "output_bytes": self.output_bytes,
+            "user_time": self.user_time,
+            "system_time": self.system_time,
+            "max_rss": self.max_rss,
+            "worker": self.worker,
+        }
+
+
+Observer = Callable[[CallRecord], Any]
+
+# Replaced rather than modified, so that it can be read without a lock
+_observers: Tuple[Observer, ...] = ()
+_observers_lock = threading.Lock()
+
+
+def get_call_observers() -> Tuple[Observer, ...]:
+    return _observers
+
+
+def add_call_observer(observer: Observer) -> None:
+    """
+    Call `observer` with a `CallRecord` after each call out to pip, in the
+    thread which made the call.
+    """
+    global _observers
+    with _observers_lock:
+        _observers = _observers + (observer,)
+
+
+def remove_call_observer(observer: Observer) -> None:
+    global _observers
+    with _observers_lock:
+        observers = list(_observers)
+        observers.remove(observer)
+        _observers = tuple(observers)
+
+
+def notify(observers: Tuple[Observer, ...], record: CallRecord) -> None:
+    # This runs while the call is finishing, so a broken observer mustn't
+    # replace the call's own result or exception
+    for observer in observers:
+        try:
+            observer(record)
+        except Exception as e:
+            warnings.warn(
+                "Call observer {!r} failed: {!r}".format(observer, e), RuntimeWarning
+            )
+
+
+class CallStats:
+    """
+    An observer which totals up calls out to pip in memory, by pip command.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands: Dict[str, Dict[str, float]] = {}
+
+    def __repr__(self):
+        return "<CallStats(commands={})>".format(sorted(self._commands))
+
+    def __call__(self, record: CallRecord) -> None:
+        with self._lock:
+            stats = self._commands.setdefault(
+                record.command,
+                {
+                    "calls": 0,
+                    "failures": 0,
+                    "duration_total": 0.0,
+                    "duration_max": 0.0,
+                    "user_time_total": 0.0,
+                    "system_time_total": 0.0,
+                    "max_rss_max": 0,
+                    "output_bytes_total": 0,
+                },
+            )
+            stats["calls"] += 1
+            if record.returncode != 0:
+                stats["failures"] += 1
+            stats["duration_total"] += record.duration
+            stats["duration_max"] = max(stats["duration_max"], record.duration)
+            stats["user_time_total"] += record.user_time or 0.0
+            stats["system_time_total"] += record.system_time or 0.0
+            stats["max_rss_max"] = max(stats["max_rss_max"], record.max_rss or 0)
+            stats["output_bytes_total"] += record.output_bytes
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return a snapshot of the totals for each pip command.
+        """
+        with self._lock:
+            return {command: dict(stats) for command, stats in self._commands.items()}
+
+
+class JSONLinesExporter:
+    """
+    An observer which writes each call out to pip as a line of JSON, to the
+    given file object or appending to the file at the given path.
+    """
+
+    def __init__(self, file: Union[str, os.PathLike, IO[str]]):
+        self._lock = threading.Lock()
+        if isinstance(file, (str, os.PathLike)):
+            self._file = open(file, "a", encoding="utf-8")
+            self._owned = True
+        else:
+            self._file = file
+            self._owned = False
+
+    def __repr__(self):
+        return "<JSONLinesExporter(file={!r})>".format(
+            getattr(self._file, "name", self._file)
+        )
+
+    def __call__(self, record: CallRecord) -> None:
+        line = json.dumps(record.to_dict()) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._owned:
+                self._file.close()
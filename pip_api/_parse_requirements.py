@@ -1,30 +1,68 @@
-import argparse
 import ast
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import json
 import os
 import posixpath
 import re
+import stat
 import string
 import sys
 import traceback
-from collections import defaultdict
-from typing import Any, Dict, Optional, Union
+from collections import defaultdict, deque
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from urllib.parse import unquote, urljoin, urlsplit
 from urllib.request import pathname2url, url2pathname
 
+from pip_api import _cache
 from pip_api._vendor import tomli
-from pip_api._vendor.packaging import requirements, specifiers  # type: ignore
+from pip_api._vendor.packaging import markers, requirements, specifiers  # type: ignore
 from pip_api.exceptions import PipError
 
-parser = argparse.ArgumentParser()
-parser.add_argument("req", nargs="*")
-parser.add_argument("-r", "--requirement")
-parser.add_argument("-e", "--editable")
-# Consume index url params to avoid trying to treat them as packages.
-parser.add_argument("-i", "--index-url")
-parser.add_argument("--extra-index-url")
-parser.add_argument("-f", "--find-links")
-parser.add_argument("--hash", action="append", dest="hashes")
-parser.add_argument("--trusted-host")
+# The options which are recognized on a line of a requirements file, and the
+# attribute of `_LineOptions` each one sets. Any other options are ignored.
+OPTIONS = {
+    "-r": "requirement",
+    "--requirement": "requirement",
+    "-e": "editable",
+    "--editable": "editable",
+    # Consume index url params to avoid trying to treat them as packages.
+    "-i": "index_url",
+    "--index-url": "index_url",
+    "--extra-index-url": "extra_index_url",
+    "-f": "find_links",
+    "--find-links": "find_links",
+    "--hash": "hashes",
+    "--trusted-host": "trusted_host",
+}
+LONG_OPTIONS = [option for option in OPTIONS if option.startswith("--")]
+NEGATIVE_NUMBER_RE = re.compile(r"^-\d+$|^-\d*\.\d+$")
+
+# Bump this whenever the format of the parse cache changes
+PARSE_CACHE_VERSION = 1
+PARSE_CACHE_DIRECTORY = "requirements"
+# How many parsed files are cached on disk, and how stale a cached file's
+# last use can be before using it records that again
+PARSE_CACHE_MAX_ENTRIES = 1000
+PARSE_CACHE_TOUCH_INTERVAL = 3600.0
+
+# How many distinct requirement strings to remember the parsed form of
+REQUIREMENT_CACHE_SIZE = 4096
+# How many local projects to remember the names of
+MAX_LOCAL_PACKAGE_NAMES = 1024
+MARKER_CACHE_SIZE = 1024
 
 operators = specifiers.Specifier._operators.keys()
 
@@ -41,6 +79,19 @@ WINDOWS = sys.platform.startswith("win") or (sys.platform == "cli" and os.name =
 # https://pip.pypa.io/en/stable/cli/pip_hash/
 VALID_HASHES = {"sha256", "sha384", "sha512"}
 
+PROJECT_TABLE_RE = re.compile(r"^[ \t]*\[[ \t]*project[ \t]*\][ \t]*(#.*)?$", re.M)
+TABLE_HEADER_RE = re.compile(r"^[ \t]*\[", re.M)
+
+# The results of looking up paths while parsing, which is only set (by
+# `_iter_with_stat_cache`) while a parse is in progress
+_stat_cache: contextvars.ContextVar[Optional[Dict[str, Optional[os.stat_result]]]] = (
+    contextvars.ContextVar("_stat_cache", default=None)
+)
+
+# The names of local projects, keyed by their directory, along with the
+# stat results of their `pyproject.toml` and `setup.py`
+_local_package_names = _cache.LRUCache(MAX_LOCAL_PACKAGE_NAMES)
+
 
 class Link:
     def __init__(self, url):
@@ -175,14 +226,56 @@ def _url_to_path(url):
     return path
 
 
+@functools.lru_cache(maxsize=REQUIREMENT_CACHE_SIZE)
+def _parse_requirement_string(requirement_string):
+    # The same requirement strings turn up in many requirements files, so
+    # only run each one through the grammar once
+    return requirements.Requirement(requirement_string)
+
+
+@functools.lru_cache(maxsize=None)
+def _default_environment() -> Tuple[Tuple[str, str], ...]:
+    # The environment markers are evaluated in can't change while we're
+    # running, so only determine it once
+    return tuple(sorted(markers.default_environment().items()))
+
+
+def _environment_key(
+    environment: Optional[Dict[str, str]] = None,
+) -> Tuple[Tuple[str, str], ...]:
+    # Like `Marker.evaluate`, an explicit environment overrides the values of
+    # the default environment
+    if environment is None:
+        return _default_environment()
+    return tuple(sorted({**dict(_default_environment()), **environment}.items()))
+
+
+@functools.lru_cache(maxsize=MARKER_CACHE_SIZE)
+def _evaluate_marker_string(marker_str, environments):
+    marker = markers.Marker(marker_str)
+    return tuple(marker.evaluate(dict(environment)) for environment in environments)
+
+
+def _evaluate_marker(marker, environments):
+    # Evaluate a marker in each of the given environments at once. Files tend
+    # to repeat the same few markers, so each one is only evaluated once.
+    return _evaluate_marker_string(str(marker), environments)
+
+
 class Requirement(requirements.Requirement):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, requirement_string, **kwargs):
         self.hashes = kwargs.pop("hashes", None)
         self.editable = kwargs.pop("editable", False)
         self.filename = kwargs.pop("filename")
         self.lineno = kwargs.pop("lineno")
 
-        super().__init__(*args, **kwargs)
+        parsed = _parse_requirement_string(requirement_string)
+        self.name = parsed.name
+        self.url = parsed.url
+        # Don't share the mutable parts of the cached requirement
+        self.extras = set(parsed.extras)
+        self.specifier = specifiers.SpecifierSet(parsed.specifier)
+        self.marker = parsed.marker
 
 
 class UnparsedRequirement(object):
@@ -197,6 +290,174 @@ class UnparsedRequirement(object):
         return self.msg
 
 
+class _LineOptions:
+    __slots__ = (
+        "req",
+        "requirement",
+        "editable",
+        "index_url",
+        "extra_index_url",
+        "find_links",
+        "hashes",
+        "trusted_host",
+    )
+
+    def __init__(self):
+        self.req = []
+        self.requirement = None
+        self.editable = None
+        self.index_url = None
+        self.extra_index_url = None
+        self.find_links = None
+        self.hashes = None
+        self.trusted_host = None
+
+
+def _is_positional(token):
+    return (
+        not token.startswith("-")
+        or token == "-"
+        or NEGATIVE_NUMBER_RE.match(token) is not None
+    )
+
+
+def _match_option(token):
+    # Return the attribute the given option sets (or None if it is not a
+    # recognized option), and the value given with it, if any
+    if token.startswith("--"):
+        option, sep, value = token.partition("=")
+        if option not in OPTIONS:
+            # Long options can be abbreviated to any unique prefix
+            matches = [o for o in LONG_OPTIONS if o.startswith(option)]
+            if len(matches) > 1:
+                raise PipError(
+                    "ambiguous option: %s could match %s" % (option, ", ".join(matches))
+                )
+            if not matches:
+                return None, None
+            option = matches[0]
+        return OPTIONS[option], value if sep else None
+
+    option, sep, value = token.partition("=")
+    if sep and option in OPTIONS:
+        return OPTIONS[option], value
+
+    # Short options can be immediately followed by their value
+    if token[:2] in OPTIONS:
+        return OPTIONS[token[:2]], token[2:] or None
+
+    return None, None
+
+
+def _tokenize(line):
+    """
+    Split a line of a requirements file into its requirement and options,
+    with the same results as `argparse` would give.
+    """
+    options = _LineOptions()
+    tokens = line.split()
+
+    # Only the first run of positional arguments makes up the requirement
+    in_req = False
+    req_done = False
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+
+        if token == "--":
+            # Everything after `--` is a positional argument
+            if not req_done:
+                options.req.extend(tokens[i:])
+            break
+
+        if _is_positional(token):
+            if not req_done:
+                options.req.append(token)
+                in_req = True
+            continue
+
+        if in_req:
+            in_req = False
+            req_done = True
+
+        attribute, value = _match_option(token)
+        if attribute is None:
+            continue
+
+        if value is None:
+            if i == len(tokens) or not _is_positional(tokens[i]):
+                raise PipError("argument %s: expected one argument" % token)
+            value = tokens[i]
+            i += 1
+
+        if attribute == "hashes":
+            options.hashes = (options.hashes or []) + [value]
+        else:
+            setattr(options, attribute, value)
+
+    return options
+
+
+def _stat(path):
+    # Return the stat result of the given path, or None if it doesn't exist.
+    # While parsing, each path is only looked up once.
+    cache = _stat_cache.get()
+    if cache is not None and path in cache:
+        return cache[path]
+
+    try:
+        result: Optional[os.stat_result] = os.stat(path)
+    except (OSError, ValueError):
+        result = None
+
+    if cache is not None:
+        cache[path] = result
+    return result
+
+
+def _exists(path):
+    return _stat(path) is not None
+
+
+def _isdir(path):
+    stat_result = _stat(path)
+    return stat_result is not None and stat.S_ISDIR(stat_result.st_mode)
+
+
+def _isfile(path):
+    stat_result = _stat(path)
+    return stat_result is not None and stat.S_ISREG(stat_result.st_mode)
+
+
+def _stat_cache_context():
+    # Return a context with its own, empty stat cache, so that the cache
+    # doesn't leak into the caller's context
+    context = contextvars.copy_context()
+    context.run(_stat_cache.set, {})
+    return context
+
+
+def _run_with_stat_cache(function, *args):
+    return _stat_cache_context().run(function, *args)
+
+
+def _iter_with_stat_cache(function, *args):
+    # As `_run_with_stat_cache`, for a function returning a generator
+    context = _stat_cache_context()
+    iterator = context.run(function, *args)
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(iterator.close)
+
+
 def _read_file(filename):
     with open(filename) as f:
         return f.readlines()
@@ -205,7 +466,7 @@ def _read_file(filename):
 def _check_invalid_requirement(req):
     if os.path.sep in req:
         add_msg = "It looks like a path."
-        if os.path.exists(req):
+        if _exists(req):
             add_msg += " It does exist."
         else:
             add_msg += " File '%s' does not exist." % (req)
@@ -242,12 +503,52 @@ def _path_to_url(path):
     return url
 
 
+def _stat_stamp(path):
+    stat_result = _stat(path)
+    if stat_result is None:
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def _project_table(pyproject_toml):
+    # Parse only the `[project]` table of a `pyproject.toml`, falling back on
+    # parsing the whole document if it isn't given as a single plain table
+    matches = list(PROJECT_TABLE_RE.finditer(pyproject_toml))
+    if len(matches) == 1:
+        match = matches[0]
+        end = TABLE_HEADER_RE.search(pyproject_toml, match.end())
+        table = pyproject_toml[match.start() : end.start() if end else None]
+        try:
+            return tomli.loads(table).get("project", {})
+        except tomli.TOMLDecodeError:
+            # e.g. a table header inside a multi-line string
+            pass
+
+    return tomli.loads(pyproject_toml).get("project", {})
+
+
 def _parse_local_package_name(path):
-    # Determine the package name from a local directory
+    # Determine the package name from a local directory, reusing the previous
+    # result if neither `pyproject.toml` nor `setup.py` has changed since
+    pyproject_toml = os.path.join(path, "pyproject.toml")
+    setup_py = os.path.join(path, "setup.py")
+    stamp = (_stat_stamp(pyproject_toml), _stat_stamp(setup_py))
+
+    key = os.path.abspath(path)
+    cached = _local_package_names.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    name = _read_local_package_name(path)
+    _local_package_names.set(key, (stamp, name))
+    return name
+
+
+def _read_local_package_name(path):
     pyproject_toml = os.path.join(path, "pyproject.toml")
     setup_py = os.path.join(path, "setup.py")
-    has_pyproject = os.path.isfile(pyproject_toml)
-    has_setup = os.path.isfile(setup_py)
+    has_pyproject = _isfile(pyproject_toml)
+    has_setup = _isfile(setup_py)
 
     if not has_pyproject and not has_setup:
         raise PipError(
@@ -258,8 +559,7 @@ def _parse_local_package_name(path):
     # Prefer the name in `pyproject.toml`
     if has_pyproject:
         with open(pyproject_toml, encoding="utf-8") as f:
-            pp_toml = tomli.loads(f.read())
-            name = pp_toml.get("project", {}).get("name")
+            name = _project_table(f.read()).get("name")
             if name is not None:
                 return name
 
@@ -291,10 +591,10 @@ def _parse_editable(editable_req):
     url_no_extras, extras = _strip_extras(url)
     original_url = url_no_extras
 
-    if os.path.isdir(original_url):
+    if _isdir(original_url):
         pyproject_path = os.path.join(original_url, "pyproject.toml")
         setup_path = os.path.join(original_url, "setup.py")
-        if not any(os.path.exists(p) for p in (pyproject_path, setup_path)):
+        if not any(_exists(p) for p in (pyproject_path, setup_path)):
             raise PipError(
                 "Directory %r is not installable. No 'setup.py' or 'pyproject.toml' found."
                 % original_url
@@ -374,11 +674,11 @@ def _looks_like_path(name):
 
 
 def _is_installable_dir(path):
-    if not os.path.isdir(path):
+    if not _isdir(path):
         return False
-    if os.path.isfile(os.path.join(path, "pyproject.toml")):
+    if _isfile(os.path.join(path, "pyproject.toml")):
         return True
-    if os.path.isfile(os.path.join(path, "setup.py")):
+    if _isfile(os.path.join(path, "setup.py")):
         return True
     return False
 
@@ -408,7 +708,7 @@ def _is_archive_file(name):
 
 
 def _get_url_from_path(path, name):
-    if _looks_like_path(name) and os.path.isdir(path):
+    if _looks_like_path(name) and _isdir(path):
         if _is_installable_dir(path):
             return _path_to_url(path)
         # TODO: The is_installable_dir test here might not be necessary
@@ -419,7 +719,7 @@ def _get_url_from_path(path, name):
         )
     if not _is_archive_file(path):
         return None
-    if os.path.isfile(path):
+    if _isfile(path):
         return _path_to_url(path)
     urlreq_parts = name.split("@", 1)
     if len(urlreq_parts) >= 2 and not _looks_like_path(urlreq_parts[0]):
@@ -483,105 +783,585 @@ def _parse_requirement_url(req_str):
     return req_str
 
 
-def parse_requirements(
+def _depends_on_filesystem(req_str):
+    # Whether parsing the given requirement depends on the contents of the
+    # filesystem, as it does for local paths and `file:` URLs
+    for v in VCS_SCHEMES:
+        if req_str.startswith(v + "+"):
+            req_str = req_str[len(v) + 1 :]
+            break
+    req_str = req_str.split(";", 1)[0]
+
+    if _is_url(req_str):
+        return _get_url_scheme(req_str) == "file"
+
+    # PEP 508 URL requirements, e.g. `name @ https://...`
+    name, sep, url = req_str.partition("@")
+    if sep and not _looks_like_path(name) and _is_url(url.strip()):
+        return _get_url_scheme(url.strip()) == "file"
+
+    return _looks_like_path(req_str) or _is_archive_file(_strip_extras(req_str)[0])
+
+
+def _cache_name(content, options):
+    # Cache entries are keyed by everything that affects how a file is parsed
+    skip_regex = options.skip_requirements_regex if options else None
+    key = json.dumps([PARSE_CACHE_VERSION, skip_regex, content])
+    return "%s/%s.json" % (
+        PARSE_CACHE_DIRECTORY,
+        hashlib.sha256(key.encode()).hexdigest(),
+    )
+
+
+def _dump_requirement(req):
+    return {
+        "name": req.name,
+        "specifier": str(req.specifier),
+        "extras": sorted(req.extras),
+        "marker": str(req.marker) if req.marker is not None else None,
+        "url": req.url,
+        "hashes": req.hashes,
+        "editable": req.editable,
+        "lineno": req.lineno,
+    }
+
+
+def _load_requirement(fields, filename):
+    # Rebuild a requirement without going through the requirement grammar
+    req = Requirement.__new__(Requirement)
+    req.name = fields["name"]
+    req.url = fields["url"]
+    req.extras = set(fields["extras"])
+    req.specifier = specifiers.SpecifierSet(fields["specifier"])
+    req.marker = markers.Marker(fields["marker"]) if fields["marker"] else None
+    req.hashes = fields["hashes"]
+    req.editable = fields["editable"]
+    req.filename = filename
+    req.lineno = fields["lineno"]
+    req.comes_from = "-r {} (line {})".format(filename, req.lineno)
+    return req
+
+
+def _logical_lines(content, options=None):
+    # Yield the numbered lines of the given contents of a requirements file
+    # which aren't comments, blank or skipped by the options
+    lines_enum = enumerate(content.splitlines(), 1)
+    lines_enum = _ignore_comments(lines_enum)
+    lines_enum = _skip_regex(lines_enum, options)
+    return lines_enum
+
+
+def _parse_line(
     filename: os.PathLike,
-    options: Optional[Any] = None,
+    lineno: int,
+    line: str,
     include_invalid: bool = False,
-    strict_hashes: bool = False,
-) -> Dict[str, Union[Requirement, UnparsedRequirement]]:
-    to_parse = {filename}
-    parsed = set()
-    name_to_req = {}
+) -> Tuple[_LineOptions, Optional[Union[Requirement, UnparsedRequirement]]]:
+    # Parse a single line of a requirements file into its options, and the
+    # requirement it gives, if any
+    req: Optional[Union[Requirement, UnparsedRequirement]] = None
+    known = _tokenize(line)
+
+    hashes_by_kind = defaultdict(list)
+    if known.hashes:
+        for hsh in known.hashes:
+            kind, hsh = hsh.split(":", 1)
+            if kind not in VALID_HASHES:
+                raise PipError(
+                    "Invalid --hash kind %s, expected one of %s" % (kind, VALID_HASHES)
+                )
+            hashes_by_kind[kind].append(hsh)
+
+    if known.req:
+        req_str = str().join(known.req)
+        try:
+            parsed_req_str = _parse_requirement_url(req_str)
+        except PipError as e:
+            if include_invalid:
+                req = UnparsedRequirement(req_str, str(e), filename, lineno)
+            else:
+                raise
 
-    while to_parse:
-        filename = to_parse.pop()
-        dirname = os.path.dirname(filename)
-        parsed.add(filename)
-
-        # Combine multi-line commands
-        lines = "".join(_read_file(filename)).replace("\\\n", "").splitlines()
-        lines_enum = enumerate(lines, 1)
-        lines_enum = _ignore_comments(lines_enum)
-        lines_enum = _skip_regex(lines_enum, options)
-
-        for lineno, line in lines_enum:
-            req: Optional[Union[Requirement, UnparsedRequirement]] = None
-            known, _ = parser.parse_known_args(line.strip().split())
-
-            hashes_by_kind = defaultdict(list)
-            if known.hashes:
-                for hsh in known.hashes:
-                    kind, hsh = hsh.split(":", 1)
-                    if kind not in VALID_HASHES:
-                        raise PipError(
-                            "Invalid --hash kind %s, expected one of %s"
-                            % (kind, VALID_HASHES)
-                        )
-                    hashes_by_kind[kind].append(hsh)
-
-            if known.req:
-                req_str = str().join(known.req)
-                try:
-                    parsed_req_str = _parse_requirement_url(req_str)
-                except PipError as e:
-                    if include_invalid:
-                        req = UnparsedRequirement(req_str, str(e), filename, lineno)
-                    else:
-                        raise
-
-                try:  # Try to parse this as a requirement specification
-                    if req is None:
-                        req = Requirement(
-                            parsed_req_str,
-                            hashes=dict(hashes_by_kind),
-                            filename=filename,
-                            lineno=lineno,
-                        )
-                except requirements.InvalidRequirement:
-                    try:
-                        _check_invalid_requirement(req_str)
-                    except PipError as e:
-                        if include_invalid:
-                            req = UnparsedRequirement(req_str, str(e), filename, lineno)
-                        else:
-                            raise
-
-            elif known.requirement:
-                full_path = os.path.join(dirname, known.requirement)
-                if full_path not in parsed:
-                    to_parse.add(full_path)
-            elif known.editable:
-                name, url = _parse_editable(known.editable)
+        try:  # Try to parse this as a requirement specification
+            if req is None:
                 req = Requirement(
-                    "%s @ %s" % (name, url),
+                    parsed_req_str,
+                    hashes=dict(hashes_by_kind),
                     filename=filename,
                     lineno=lineno,
-                    editable=True,
                 )
-            else:
-                pass  # This is an invalid requirement
+        except requirements.InvalidRequirement:
+            try:
+                _check_invalid_requirement(req_str)
+            except PipError as e:
+                if include_invalid:
+                    req = UnparsedRequirement(req_str, str(e), filename, lineno)
+                else:
+                    raise
+
+    elif known.requirement:
+        pass  # This is an included file, which is left to the caller
+    elif known.editable:
+        name, url = _parse_editable(known.editable)
+        req = Requirement(
+            "%s @ %s" % (name, url),
+            filename=filename,
+            lineno=lineno,
+            editable=True,
+        )
+    else:
+        pass  # This is an invalid requirement
 
-            # If we've found a requirement, add it
-            if req:
-                if not isinstance(req, UnparsedRequirement):
-                    req.comes_from = "-r {} (line {})".format(filename, lineno)  # type: ignore
-                    if req.marker is not None and not req.marker.evaluate():
-                        continue
+    if req and not isinstance(req, UnparsedRequirement):
+        req.comes_from = "-r {} (line {})".format(filename, lineno)  # type: ignore
 
-                if req.name not in name_to_req:
-                    name_to_req[req.name.lower()] = req
+    return known, req
+
+
+def _iter_file(
+    filename: os.PathLike,
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    cache: bool = False,
+) -> Iterator[Union[Requirement, UnparsedRequirement, str]]:
+    # Yield the requirements in a single requirements file, and the paths of
+    # any files it includes with `-r`, in the order they appear
+    dirname = os.path.dirname(filename)
+
+    # Combine multi-line commands
+    content = "".join(_read_file(filename)).replace("\\\n", "")
+
+    # The items parsed from this file, to be cached if they don't depend on
+    # anything but the contents of the file
+    cached: Optional[List[List[Any]]] = None
+    if cache:
+        name = _cache_name(content, options)
+        entry = _cache.load(name)
+        if "items" in entry:
+            _cache.touch(name, PARSE_CACHE_TOUCH_INTERVAL)
+            for kind, value in entry["items"]:
+                if kind == "requirement":
+                    yield os.path.join(dirname, value)
+                else:
+                    yield _load_requirement(value, filename)
+            return
+        cached = []
+
+    for lineno, line in _logical_lines(content, options):
+        known, req = _parse_line(filename, lineno, line, include_invalid)
+
+        if not known.req and known.requirement:
+            if cached is not None:
+                cached.append(["requirement", known.requirement])
+            yield os.path.join(dirname, known.requirement)
+
+        if req:
+            if cached is not None:
+                if (
+                    isinstance(req, UnparsedRequirement)
+                    or req.editable
+                    or _depends_on_filesystem(str().join(known.req))
+                ):
+                    cached = None
                 else:
-                    raise PipError(
-                        "Double requirement given: %s (already in %s, name=%r)"
-                        % (req, name_to_req[req.name], req.name)
-                    )
+                    cached.append(["req", _dump_requirement(req)])
+
+            yield req
+
+    if cached is not None:
+        _cache.store(name, {"items": cached})
+        _cache.prune(PARSE_CACHE_DIRECTORY, PARSE_CACHE_MAX_ENTRIES)
+
+
+def _iter_files(
+    filename: os.PathLike,
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    cache: bool = False,
+) -> Iterator[Union[Requirement, UnparsedRequirement]]:
+    # Yield the requirements in the given file and every file it includes,
+    # parsing one file at a time
+    to_parse = deque([filename])
+    parsed = {filename}
+
+    while to_parse:
+        for item in _iter_file(to_parse.popleft(), options, include_invalid, cache):
+            if isinstance(item, str):
+                if item not in parsed:
+                    parsed.add(item)
+                    to_parse.append(item)
+                continue
+            yield item
+
+
+def _iter_files_concurrently(
+    filename: os.PathLike,
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    cache: bool = False,
+    workers: Optional[int] = None,
+) -> Iterator[Union[Requirement, UnparsedRequirement]]:
+    # As `_iter_files`, but each file is read and parsed on a thread pool as
+    # soon as it is included. The results are still yielded (and any errors
+    # raised) in exactly the order `_iter_files` would give.
+
+    def parse_file(path):
+        items: List[Union[Requirement, UnparsedRequirement, str]] = []
+        try:
+            for item in _iter_file(path, options, include_invalid, cache):
+                items.append(item)
+        except Exception as e:
+            # Defer the error until this file is reached in order
+            return items, e
+        return items, None
+
+    futures: Dict[Any, concurrent.futures.Future] = {}
+    unexpanded = set()
+
+    def schedule(path):
+        if path not in futures:
+            # Share this parse's stat cache with the thread
+            context = contextvars.copy_context()
+            futures[path] = executor.submit(context.run, parse_file, path)
+            unexpanded.add(futures[path])
+
+    def expand(future):
+        # Start parsing the files included by a parsed file right away, rather
+        # than waiting until they are reached
+        unexpanded.discard(future)
+        items, _ = future.result()
+        for item in items:
+            if isinstance(item, str):
+                schedule(item)
+
+    to_parse = deque([filename])
+    parsed = {filename}
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        schedule(filename)
+        while to_parse:
+            future = futures[to_parse.popleft()]
+            while not future.done():
+                done, _ = concurrent.futures.wait(
+                    unexpanded, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for other in done:
+                    expand(other)
+
+            items, error = future.result()
+            for item in items:
+                if isinstance(item, str):
+                    if item not in parsed:
+                        parsed.add(item)
+                        to_parse.append(item)
+                        schedule(item)
+                    continue
+                yield item
+
+            if error is not None:
+                raise error
+    finally:
+        # Don't keep parsing if the caller stops early or a file fails
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_requirements(
+    filename: os.PathLike,
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    check_duplicates: bool = False,
+    workers: Optional[int] = None,
+    cache: bool = False,
+    environment: Optional[Dict[str, str]] = None,
+) -> Iterator[Union[Requirement, UnparsedRequirement]]:
+    """
+    Yield the requirements in the given requirements file as they are parsed.
+    Files included with `-r` are parsed after the file including them, in the
+    order they are first included. If `workers` is more than 1, up to that
+    many included files are read and parsed concurrently. If `cache` is true, the
+    parsed contents of each file are cached on disk.
+    """
+    return _filter_requirements(
+        _iter_with_stat_cache(
+            _iter_all_files, filename, options, include_invalid, cache, workers
+        ),
+        check_duplicates,
+        environment,
+    )
+
+
+def _iter_all_files(filename, options, include_invalid, cache, workers):
+    # A single worker couldn't parse anything concurrently anyway
+    if workers is None or workers <= 1:
+        return _iter_files(filename, options, include_invalid, cache)
+    return _iter_files_concurrently(filename, options, include_invalid, cache, workers)
+
+
+def _add_requirement(
+    name_to_req: Dict[str, Union[Requirement, UnparsedRequirement]],
+    req: Union[Requirement, UnparsedRequirement],
+) -> None:
+    if req.name not in name_to_req:
+        name_to_req[req.name.lower()] = req
+    else:
+        raise PipError(
+            "Double requirement given: %s (already in %s, name=%r)"
+            % (req, name_to_req[req.name], req.name)
+        )
+
+
+def _filter_requirements(
+    reqs: Iterable[Union[Requirement, UnparsedRequirement]],
+    check_duplicates: bool = False,
+    environment: Optional[Dict[str, str]] = None,
+) -> Iterator[Union[Requirement, UnparsedRequirement]]:
+    # Drop requirements whose markers don't match the environment, and
+    # optionally check for requirements which are given twice
+    environments = (_environment_key(environment),)
+    name_to_req: Dict[str, Union[Requirement, UnparsedRequirement]] = {}
+
+    for req in reqs:
+        if not isinstance(req, UnparsedRequirement):
+            if req.marker is not None:
+                if not _evaluate_marker(req.marker, environments)[0]:
+                    continue
+
+        if check_duplicates:
+            _add_requirement(name_to_req, req)
+
+        yield req
+
+
+def _check_hashes(
+    name_to_req: Dict[str, Union[Requirement, UnparsedRequirement]],
+) -> None:
+    missing_hashes = [req for req in name_to_req.values() if not req.hashes]
+    if len(missing_hashes) > 0:
+        raise PipError(
+            "Missing hashes for requirement in %s, line %s"
+            % (missing_hashes[0].filename, missing_hashes[0].lineno)
+        )
+
+
+def parse_requirements(
+    filename: os.PathLike,
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    strict_hashes: bool = False,
+    workers: Optional[int] = None,
+    cache: bool = False,
+    environment: Optional[Dict[str, str]] = None,
+) -> Dict[str, Union[Requirement, UnparsedRequirement]]:
+    name_to_req = {
+        req.name.lower(): req  # type: ignore
+        for req in iter_requirements(
+            filename,
+            options,
+            include_invalid,
+            check_duplicates=True,
+            workers=workers,
+            cache=cache,
+            environment=environment,
+        )
+    }
 
     if strict_hashes:
-        missing_hashes = [req for req in name_to_req.values() if not req.hashes]
-        if len(missing_hashes) > 0:
-            raise PipError(
-                "Missing hashes for requirement in %s, line %s"
-                % (missing_hashes[0].filename, missing_hashes[0].lineno)
-            )
+        _check_hashes(name_to_req)
 
     return name_to_req
+
+
+def parse_requirements_for_environments(
+    filename: os.PathLike,
+    environments: Sequence[Dict[str, str]],
+    options: Optional[Any] = None,
+    include_invalid: bool = False,
+    strict_hashes: bool = False,
+    workers: Optional[int] = None,
+    cache: bool = False,
+) -> List[Dict[str, Union[Requirement, UnparsedRequirement]]]:
+    """
+    Parse the given requirements file once, and return the requirements which
+    apply in each of the given environments, in the same order.
+    """
+    keys = tuple(_environment_key(environment) for environment in environments)
+    results: List[Dict[str, Union[Requirement, UnparsedRequirement]]] = [
+        {} for _ in keys
+    ]
+
+    for req in _iter_with_stat_cache(
+        _iter_all_files, filename, options, include_invalid, cache, workers
+    ):
+        if isinstance(req, UnparsedRequirement) or req.marker is None:
+            matches: Tuple[bool, ...] = (True,) * len(keys)
+        else:
+            matches = _evaluate_marker(req.marker, keys)
+
+        for name_to_req, match in zip(results, matches):
+            if match:
+                _add_requirement(name_to_req, req)
+
+    if strict_hashes:
+        for name_to_req in results:
+            _check_hashes(name_to_req)
+
+    return results
+
+
+def _requirement_key(req):
+    # What has to differ for a requirement to be considered changed
+    if isinstance(req, UnparsedRequirement):
+        return (str(req.name), str(req))
+    return (str(req), req.hashes, req.editable)
+
+
+class RequirementsDiff:
+    def __init__(
+        self,
+        added: Dict[str, Union[Requirement, UnparsedRequirement]],
+        removed: Dict[str, Union[Requirement, UnparsedRequirement]],
+        changed: Dict[
+            str,
+            Tuple[
+                Union[Requirement, UnparsedRequirement],
+                Union[Requirement, UnparsedRequirement],
+            ],
+        ],
+    ):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return "<RequirementsDiff(added={!r}, removed={!r}, changed={!r})>".format(
+            list(self.added), list(self.removed), list(self.changed)
+        )
+
+
+class RequirementsDocument:
+    """
+    The requirements in a requirements file and the files it includes, which
+    can be updated when one of the files changes by parsing only the lines
+    which changed.
+    """
+
+    def __init__(
+        self,
+        filename: os.PathLike,
+        options: Optional[Any] = None,
+        include_invalid: bool = False,
+        environment: Optional[Dict[str, str]] = None,
+    ):
+        self.filename = filename
+        self.options = options
+        self.include_invalid = include_invalid
+        self.environment = environment
+
+        # The logical lines of each file, in the order the files are parsed,
+        # as (line, lineno, included file, requirement) tuples
+        self._files: Dict[Any, List[Tuple[str, int, Optional[str], Any]]] = {}
+        self.requirements: Dict[str, Union[Requirement, UnparsedRequirement]] = {}
+
+        self._files, self.requirements = _run_with_stat_cache(self._parse, {})
+
+    @property
+    def files(self) -> List[os.PathLike]:
+        return list(self._files)
+
+    def _parse_file(self, path, previous):
+        # Parse a file, reusing the results of any lines which were also in
+        # the previous version of it
+        reuse = {}
+        for line, lineno, include, req in previous:
+            reuse.setdefault(line, (lineno, include, req))
+
+        dirname = os.path.dirname(path)
+        content = "".join(_read_file(path)).replace("\\\n", "")
+        result = []
+        for lineno, line in _logical_lines(content, self.options):
+            if line in reuse:
+                old_lineno, include, req = reuse[line]
+                if req and old_lineno != lineno:
+                    # The line has only moved, so just renumber a copy of it
+                    # (`copy.copy` would parse the requirement again)
+                    req, old_req = object.__new__(type(req)), req
+                    req.__dict__.update(old_req.__dict__)
+                    req.lineno = lineno
+                    if not isinstance(req, UnparsedRequirement):
+                        req.comes_from = "-r {} (line {})".format(path, lineno)
+            else:
+                known, req = _parse_line(path, lineno, line, self.include_invalid)
+                include = None
+                if not known.req and known.requirement:
+                    include = os.path.join(dirname, known.requirement)
+            result.append((line, lineno, include, req))
+        return result
+
+    def _parse(self, files):
+        # Walk the included files in the same order as `iter_requirements`,
+        # reusing the given results for any files which haven't changed
+        new_files = {}
+        reqs = []
+        to_parse = deque([self.filename])
+
+        while to_parse:
+            path = to_parse.popleft()
+            if path in files:
+                new_files[path] = files[path]
+            else:
+                new_files[path] = self._parse_file(path, [])
+
+            for _, _, include, req in new_files[path]:
+                if include is not None and include not in new_files:
+                    if include not in to_parse:
+                        to_parse.append(include)
+                if req:
+                    reqs.append(req)
+
+        name_to_req = {
+            req.name.lower(): req
+            for req in _filter_requirements(
+                reqs, check_duplicates=True, environment=self.environment
+            )
+        }
+        return new_files, name_to_req
+
+    def _reparse(self, target):
+        files = dict(self._files)
+        for path in files:
+            if os.path.normpath(os.path.abspath(path)) == target:
+                files[path] = self._parse_file(path, files[path])
+        return self._parse(files)
+
+    def update(self, filename: os.PathLike) -> RequirementsDiff:
+        """
+        Re-parse the given file after it has changed, and return how the
+        requirements changed as a result. Files which aren't part of this
+        document are ignored.
+        """
+        target = os.path.normpath(os.path.abspath(filename))
+        new_files, name_to_req = _run_with_stat_cache(self._reparse, target)
+
+        added = {
+            name: req
+            for name, req in name_to_req.items()
+            if name not in self.requirements
+        }
+        removed = {
+            name: req
+            for name, req in self.requirements.items()
+            if name not in name_to_req
+        }
+        changed = {
+            name: (self.requirements[name], req)
+            for name, req in name_to_req.items()
+            if name in self.requirements
+            and _requirement_key(req) != _requirement_key(self.requirements[name])
+        }
+
+        self._files, self.requirements = new_files, name_to_req
+        return RequirementsDiff(added, removed, changed)
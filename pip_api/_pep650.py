@@ -3,23 +3,28 @@ import subprocess
 from pip_api._call import call
 
 
-def invoke_install(path, *, dependency_group=None, **kwargs):
+def invoke_install(path, *, dependency_group=None, timeout=None, **kwargs):
     try:
         call(
-            "install", "--requirement", dependency_group or "requirements.txt", cwd=path
+            "install",
+            "--requirement",
+            dependency_group or "requirements.txt",
+            cwd=path,
+            timeout=timeout,
         )
     except subprocess.CalledProcessError as e:
         return e.returncode
     return 0
 
 
-def invoke_uninstall(path, *, dependency_group=None, **kwargs):
+def invoke_uninstall(path, *, dependency_group=None, timeout=None, **kwargs):
     try:
         call(
             "uninstall",
             "--requirement",
             dependency_group or "requirements.txt",
             cwd=path,
+            timeout=timeout,
         )
     except subprocess.CalledProcessError as e:
         return e.returncode
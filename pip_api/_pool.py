@@ -0,0 +1,230 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from pip_api.exceptions import QueueFull
+
+# The priority of calls made in the current context, see `call_priority`
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("_priority", default=0)
+
+
+class _AsyncWaiter:
+    """
+    Like a `threading.Event` for a call waiting in a `CallPool`, but which
+    wakes a coroutine rather than a thread, so that waiting takes no thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self._set = False
+
+    def set(self) -> None:
+        self._set = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def _wake(self):
+        # The waiter may have stopped waiting, e.g. if it was cancelled
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class CallPool:
+    """
+    Limits how many pip processes pip_api runs at once. Calls beyond the limit
+    wait in a queue, highest priority first and otherwise in the order they
+    were made.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_wait: Optional[float] = None,
+    ):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._running = 0
+        # A heap of [-priority, sequence, waiter] entries for waiting calls,
+        # where the waiter is a `threading.Event` or an `_AsyncWaiter`
+        self._waiting: List[List] = []
+        self._sequence = itertools.count()
+
+        self._calls = 0
+        self._rejected = 0
+        self._queue_depth_max = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _record_wait(self, wait_time: float):
+        # Must be called with the lock held
+        self._calls += 1
+        self._wait_time_total += wait_time
+        self._wait_time_max = max(self._wait_time_max, wait_time)
+
+    def _enqueue(self, priority: int, waiter: Callable[[], Any]) -> Optional[List]:
+        # Take a free slot, returning None, or join the queue, returning the
+        # queue entry
+        with self._lock:
+            if self._running < self.max_concurrency and not self._waiting:
+                self._running += 1
+                self._record_wait(0.0)
+                return None
+
+            if self.max_queue is not None and len(self._waiting) >= self.max_queue:
+                self._rejected += 1
+                raise QueueFull(
+                    "Too many pip calls are waiting ({})".format(len(self._waiting))
+                )
+
+            entry = [-priority, next(self._sequence), waiter()]
+            heapq.heappush(self._waiting, entry)
+            self._queue_depth_max = max(self._queue_depth_max, len(self._waiting))
+            return entry
+
+    def _dequeue(self, entry: List, timed_out: bool) -> bool:
+        # Stop waiting, returning False if the slot was handed over to us in
+        # the meantime, in which case it's ours
+        with self._lock:
+            if entry[2].is_set():
+                return False
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            if timed_out:
+                self._rejected += 1
+            return True
+
+    def _waited(self, start: float) -> None:
+        with self._lock:
+            self._record_wait(time.monotonic() - start)
+
+    def acquire(self, priority: int = 0) -> None:
+        """
+        Wait for a slot to run a call in, raising `QueueFull` if too many calls
+        are already waiting, or if no slot is free within `max_wait` seconds.
+        """
+        entry = self._enqueue(priority, threading.Event)
+        if entry is None:
+            return
+
+        start = time.monotonic()
+        if not entry[2].wait(self.max_wait):
+            if self._dequeue(entry, timed_out=True):
+                raise QueueFull(
+                    "Timed out waiting {}s to call pip".format(self.max_wait)
+                )
+
+        self._waited(start)
+
+    async def acquire_async(self, priority: int = 0) -> None:
+        """
+        As `acquire`, but waits without blocking the event loop or a thread.
+        """
+        # Only `pip_api.aio` needs asyncio, so don't import it with pip_api
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        entry = self._enqueue(priority, lambda: _AsyncWaiter(loop))
+        if entry is None:
+            return
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(entry[2].future, self.max_wait)
+        except asyncio.TimeoutError:
+            if self._dequeue(entry, timed_out=True):
+                raise QueueFull(
+                    "Timed out waiting {}s to call pip".format(self.max_wait)
+                ) from None
+        except asyncio.CancelledError:
+            if not self._dequeue(entry, timed_out=False):
+                # Nobody is going to use the slot we were given
+                self.release()
+            raise
+
+        self._waited(start)
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiting:
+                # Hand the slot straight to the next call in line
+                heapq.heappop(self._waiting)[2].set()
+            else:
+                self._running -= 1
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire(_priority.get())
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        await self.acquire_async(_priority.get())
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Return a snapshot of how busy the pool is, and has been.
+        """
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": len(self._waiting),
+                "calls": self._calls,
+                "rejected": self._rejected,
+                "queue_depth_max": self._queue_depth_max,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_max": self._wait_time_max,
+            }
+
+    def __repr__(self):
+        return "<CallPool(max_concurrency={}, max_queue={}, max_wait={})>".format(
+            self.max_concurrency, self.max_queue, self.max_wait
+        )
+
+
+_pool: Optional[CallPool] = None
+
+
+def get_call_pool() -> Optional[CallPool]:
+    return _pool
+
+
+def set_call_pool(pool: Optional[CallPool]) -> Optional[CallPool]:
+    """
+    Make every call out to pip go through the given pool (or through no pool,
+    if None), returning the previous pool.
+    """
+    global _pool
+    previous, _pool = _pool, pool
+    return previous
+
+
+@contextlib.contextmanager
+def call_priority(priority: int) -> Iterator[None]:
+    """
+    Give calls out to pip made within this context the given priority when
+    they're waiting in a `CallPool`. Higher priorities go first.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
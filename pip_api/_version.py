@@ -1,10 +1,134 @@
-from pip_api._call import call
+import glob
+import importlib.util
+import os
+import re
+import sys
+from typing import List, Optional
 
+from pip_api import _cache
+from pip_api._call import call, get_python_location
 
-def version() -> str:
-    result = call("--version")
+CACHE_NAME = "pip-version.json"
 
-    # result is of the form:
-    # pip <version> from <directory> (python <python version>)
+# result is of the form:
+# pip <version> from <directory> (python <python version>)
+VERSION_RE = re.compile(
+    r"^pip (?P<version>\S+) from (?P<location>.+) \(python [^)]*\)$"
+)
 
-    return result.split(" ")[1]
+
+def _dist_infos(location: str) -> List[str]:
+    # pip's metadata lives alongside the package itself, in site-packages
+    return sorted(
+        glob.glob(
+            os.path.join(glob.escape(os.path.dirname(location)), "pip-*.dist-info")
+        )
+    )
+
+
+def _fingerprint(location: str) -> Optional[List[List[int]]]:
+    # Identify a pip installation by the stat results of its `__init__.py` and
+    # its metadata, both of which are rewritten whenever pip is upgraded
+    paths = [os.path.join(location, "__init__.py")] + [
+        os.path.join(dist_info, "METADATA") for dist_info in _dist_infos(location)
+    ]
+
+    try:
+        stats = [os.stat(path) for path in paths]
+    except OSError:
+        return None
+
+    return [[stat.st_mtime_ns, stat.st_size] for stat in stats]
+
+
+def _read_version(location: str) -> Optional[str]:
+    # Read the version of the pip installed at the given location from its
+    # METADATA, if it can be determined unambiguously
+    dist_infos = _dist_infos(location)
+    if len(dist_infos) != 1:
+        return None
+
+    try:
+        with open(os.path.join(dist_infos[0], "METADATA"), encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    # End of the headers
+                    break
+                if line.startswith("Version:"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+
+    return None
+
+
+def _current_location() -> Optional[str]:
+    # Find pip in the current interpreter without importing it
+    try:
+        spec = importlib.util.find_spec("pip")
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None:
+        return None
+    return os.path.dirname(spec.origin)
+
+
+def _known_version(key: str) -> Optional[str]:
+    # Determine the version of pip for the given interpreter without calling
+    # out to pip, if possible
+
+    # If pip_api is targeting this interpreter, we can read pip's version
+    # directly
+    if key == os.path.abspath(sys.executable):
+        location = _current_location()
+        if location is not None:
+            result = _read_version(location)
+            if result is not None:
+                return result
+
+    cache = _cache.load(CACHE_NAME)
+
+    entry = cache.get(key)
+    if entry:
+        fingerprint = _fingerprint(entry["location"])
+        if fingerprint == entry["fingerprint"]:
+            return entry["version"]
+
+        # If pip is still installed in the same place, it has probably been
+        # upgraded, so read the new version from its metadata
+        result = _read_version(entry["location"]) if fingerprint else None
+        if result is not None:
+            cache[key] = {**entry, "version": result, "fingerprint": fingerprint}
+            _cache.store(CACHE_NAME, cache)
+            return result
+
+    return None
+
+
+def _parse_version(key: str, result: str) -> str:
+    # Parse the output of `pip --version`, and remember where pip is installed
+    match = VERSION_RE.match(result.strip())
+    if match is None:
+        return result.split(" ")[1]
+
+    fingerprint = _fingerprint(match.group("location"))
+    if fingerprint is not None:
+        cache = _cache.load(CACHE_NAME)
+        cache[key] = {
+            "version": match.group("version"),
+            "location": match.group("location"),
+            "fingerprint": fingerprint,
+        }
+        _cache.store(CACHE_NAME, cache)
+
+    return match.group("version")
+
+
+def version(timeout: Optional[float] = None) -> str:
+    key = os.path.abspath(get_python_location())
+
+    result = _known_version(key)
+    if result is not None:
+        return result
+
+    return _parse_version(key, call("--version", timeout=timeout))
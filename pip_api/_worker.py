@@ -0,0 +1,229 @@
+"""
+A long-lived process which runs pip commands for pip_api, so that pip only
+has to be imported once per interpreter rather than once per command.
+
+This is run with `python -c` by the interpreter being targeted, so it can
+only depend on the standard library and pip itself.
+
+Messages in both directions are JSON objects, each preceded by its length as
+a 4-byte big-endian integer. Once pip has been imported, the worker sends
+`{"ready": true}` (or `{"error": ...}` if pip can't be used), and then
+answers each `{"args": [...], "cwd": ..., "env": {...}, "limits": {...}}`
+request with `{"returncode": ..., "output": <base64 encoded stdout>,
+"usage": {...}}`, where "usage" is the command's resource usage, if known.
+"""
+
+import base64
+import importlib
+import io
+import json
+import os
+import struct
+import sys
+import traceback
+
+HEADER = struct.Struct(">I")
+
+
+def read_message(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    # The other end may have died partway through a message
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def write_message(stream, message):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def load_pip():
+    # Import pip's entry point and all of its commands up front, since that's
+    # the time we're trying to save
+    try:
+        from pip._internal.cli.main import main
+    except ImportError:
+        from pip._internal.main import main  # type: ignore
+
+    try:
+        from pip._internal.commands import commands_dict
+    except ImportError:
+        commands_dict = {}
+
+    for info in commands_dict.values():
+        module_path = getattr(info, "module_path", None)
+        if module_path is not None:
+            try:
+                importlib.import_module(module_path)
+            except Exception:
+                pass
+
+    return main
+
+
+def usage(rusage):
+    # The parts of a `resource.struct_rusage` pip_api reports; ru_maxrss is
+    # in bytes on macOS, and in kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "max_rss": rusage.ru_maxrss * scale,
+    }
+
+
+def set_resource_limits(limits):
+    # Cap this process's resources, e.g. {"RLIMIT_AS": <bytes>}, without ever
+    # raising an existing limit
+    import resource
+
+    for name, limit in limits.items():
+        key = getattr(resource, name)
+        _, hard = resource.getrlimit(key)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(key, (limit, limit))
+
+
+def run(main, args):
+    # Run pip like `python -m pip` would, returning its exit code
+    try:
+        return main(args) or 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        sys.stderr.write("%s\n" % e.code)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+def run_in_child(main, request):
+    # Run each command in a forked child, so that nothing it does to the
+    # process's state can affect the next one
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        returncode = 1
+        try:
+            os.close(read_fd)
+            os.dup2(write_fd, 1)
+            os.close(write_fd)
+            null_fd = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null_fd, 0)
+            os.close(null_fd)
+            sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+
+            os.environ.clear()
+            os.environ.update(request["env"])
+            if request["cwd"] is not None:
+                os.chdir(request["cwd"])
+            set_resource_limits(request.get("limits") or {})
+
+            returncode = run(main, request["args"])
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(returncode)
+
+    os.close(write_fd)
+    chunks = []
+    with open(read_fd, "rb") as f:
+        while True:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    _, status, rusage = os.wait4(pid, 0)
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+
+    return returncode, b"".join(chunks), usage(rusage)
+
+
+def run_in_process(main, request):
+    # Without fork, run the command here, restoring what we can afterwards
+    environ = dict(os.environ)
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    output = io.BytesIO()
+
+    try:
+        os.environ.clear()
+        os.environ.update(request["env"])
+        if request["cwd"] is not None:
+            os.chdir(request["cwd"])
+        sys.stdout = io.TextIOWrapper(output, encoding="utf-8", write_through=True)
+
+        returncode = run(main, request["args"])
+        sys.stdout.flush()
+        return returncode, output.getvalue(), None
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def serve():
+    # Keep the original stdin and stdout for messages, and make sure nothing
+    # else can read or write them
+    requests = os.fdopen(os.dup(0), "rb")
+    responses = os.fdopen(os.dup(1), "wb")
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    os.dup2(2, 1)
+
+    # Like `python -m pip`, don't import anything from the working directory
+    if sys.path and sys.path[0] in ("", os.getcwd()):
+        sys.path.pop(0)
+
+    try:
+        main = load_pip()
+    except BaseException:
+        write_message(responses, {"error": traceback.format_exc()})
+        return
+
+    write_message(responses, {"ready": True})
+
+    while True:
+        request = read_message(requests)
+        if request is None:
+            # pip_api has gone away
+            return
+
+        if hasattr(os, "fork"):
+            returncode, output, resources = run_in_child(main, request)
+        else:
+            returncode, output, resources = run_in_process(main, request)
+
+        write_message(
+            responses,
+            {
+                "returncode": returncode,
+                "output": base64.b64encode(output).decode("ascii"),
+                "usage": resources,
+            },
+        )
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,158 @@
+"""
+asyncio counterparts of the pip_api functions which call out to pip.
+"""
+
+import asyncio
+import contextlib
+import os
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+import pip_api
+from pip_api import (
+    _call,
+    _hash,
+    _installed_distributions,
+    _observers,
+    _pool,
+    _version,
+)
+from pip_api._installed_distributions import Distribution
+from pip_api._vendor.packaging import version as packaging_version
+from pip_api.exceptions import PipTimeout
+
+
+@contextlib.asynccontextmanager
+async def _pool_slot():
+    # Wait for a slot in the call pool, if there is one
+    pool = _pool.get_call_pool()
+    if pool is None:
+        yield
+        return
+
+    async with pool.slot_async():
+        yield
+
+
+async def call(
+    *args,
+    cwd=None,
+    python_location: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    Run pip with the given arguments and return its output, like
+    `subprocess.check_output`. If the call is cancelled or takes longer than
+    `timeout` seconds, pip is killed along with anything it started, raising
+    `PipTimeout` on timeout.
+    """
+    async with _pool_slot():
+        return await _call_unpooled(args, cwd, python_location, timeout)
+
+
+async def _call_unpooled(args, cwd, python_location, timeout) -> str:
+    cmd = _call.command(args, python_location)
+    observers = _observers.get_call_observers()
+    if observers:
+        start, started = time.time(), time.perf_counter()
+
+    process = await asyncio.create_subprocess_exec(
+        *_call.limited(cmd),
+        cwd=cwd,
+        env=_call.environment(),
+        stdout=subprocess.PIPE,
+        **_call.popen_kwargs(),
+    )
+
+    stdout = b""
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise PipTimeout(cmd, timeout) from None
+    finally:
+        if process.returncode is None:
+            _call.kill(process)
+            # Don't leave a zombie process behind, even if we're cancelled
+            await asyncio.shield(process.wait())
+
+        # asyncio reaps pip itself, so its resource usage isn't known
+        if observers:
+            _call.record(
+                observers, cmd, cwd, start, started, process.returncode, len(stdout)
+            )
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout)
+
+    return stdout.decode()
+
+
+async def version(timeout: Optional[float] = None) -> str:
+    key = os.path.abspath(_call.get_python_location())
+
+    result = _version._known_version(key)
+    if result is not None:
+        return result
+
+    return _version._parse_version(key, await call("--version", timeout=timeout))
+
+
+async def _pip_version(timeout: Optional[float] = None):
+    # As `pip_api.PIP_VERSION`, but without blocking the event loop
+    if "PIP_VERSION" not in vars(pip_api):
+        pip_api.PIP_VERSION = packaging_version.parse(await version(timeout=timeout))
+    return pip_api.PIP_VERSION
+
+
+async def hash(
+    filename: os.PathLike,
+    algorithm: str = "sha256",
+    use_subprocess: bool = False,
+    cache: Optional[_hash.HashCache] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    Hash the given filename.
+    """
+
+    _hash._check_algorithm(algorithm)
+
+    if not use_subprocess:
+        # Hashing in a thread can't be interrupted, so `timeout` only applies
+        # to calling out to pip
+        digests = await asyncio.to_thread(
+            _hash._hash_file_cached, filename, [algorithm], cache
+        )
+        return digests[algorithm]
+
+    result = await call("hash", "--algorithm", algorithm, filename, timeout=timeout)
+
+    return _hash._parse_hash(result)
+
+
+async def installed_distributions(
+    local: bool = False,
+    paths: List[os.PathLike] = [],
+    native: bool = False,
+    python_location: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Distribution]:
+    await _pip_version(timeout)
+
+    if native:
+        return await asyncio.to_thread(
+            _installed_distributions._native_installed_distributions,
+            local,
+            paths,
+            python_location,
+            timeout,
+        )
+
+    result = await call(
+        *_installed_distributions._list_args(local, paths),
+        python_location=python_location,
+        timeout=timeout,
+    )
+
+    return _installed_distributions._parse_list(result)
@@ -1,3 +1,6 @@
+import subprocess
+
+
 class Incompatible(Exception):
     pass
 
@@ -8,3 +11,11 @@ class InvalidArguments(Exception):
 
 class PipError(Exception):
     pass
+
+
+class QueueFull(PipError):
+    pass
+
+
+class PipTimeout(PipError, subprocess.TimeoutExpired):
+    pass
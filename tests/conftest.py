@@ -97,6 +97,9 @@ def isolate(tmpdir):
     # We want to disable the version check from running in the tests
     os.environ["PIP_DISABLE_PIP_VERSION_CHECK"] = "true"
 
+    # Keep pip_api's own caches out of the user's cache directory
+    os.environ["PIPAPI_CACHE_DIR"] = os.path.join(str(tmpdir), "cache")
+
 
 @pytest.fixture
 def temp_venv(tmpdir, isolate):
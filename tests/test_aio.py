@@ -0,0 +1,99 @@
+import asyncio
+import subprocess
+
+import pytest
+
+import pip_api
+import pip_api.aio
+
+
+def test_call(pip):
+    result = asyncio.run(pip_api.aio.call("--version"))
+
+    assert result == pip.run("--version")
+
+
+def test_call_fails(pip):
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(pip_api.aio.call("not-a-command"))
+
+
+def test_call_timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(pip_api.aio.call("--version", timeout=0.001))
+
+
+def test_call_cancelled(monkeypatch):
+    processes = []
+    original_create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, **kwargs):
+        process = await original_create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", create_subprocess_exec)
+
+    async def cancel_call():
+        task = asyncio.ensure_future(pip_api.aio.call("--version"))
+        while not processes:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_call())
+
+    # The process should have been killed and reaped
+    assert processes[0].returncode is not None
+
+
+def test_version(pip):
+    assert asyncio.run(pip_api.aio.version()) == pip_api.version()
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "sha384", "sha512"])
+def test_hash(some_distribution, algorithm):
+    result = asyncio.run(
+        pip_api.aio.hash(some_distribution.filename, algorithm=algorithm)
+    )
+
+    assert result == pip_api.hash(some_distribution.filename, algorithm=algorithm)
+
+
+def test_hash_invalid_algorithm():
+    with pytest.raises(pip_api.exceptions.InvalidArguments):
+        asyncio.run(pip_api.aio.hash("whatever", "invalid"))
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_installed_distributions(pip, some_distribution, native):
+    pip.run("install", some_distribution.filename)
+
+    async def gather():
+        return await asyncio.gather(
+            pip_api.aio.installed_distributions(native=native),
+            pip_api.aio.installed_distributions(native=native),
+        )
+
+    first, second = asyncio.run(gather())
+
+    assert some_distribution.name in first
+    assert list(first) == list(second) == list(pip_api.installed_distributions())
+
+
+def test_installed_distributions_pip_version_timeout(monkeypatch):
+    # Make sure the real version is computed, so that it's restored afterwards
+    real_version = str(pip_api.PIP_VERSION)
+    timeouts = []
+
+    async def fake_version(timeout=None):
+        timeouts.append(timeout)
+        return real_version
+
+    monkeypatch.delattr(pip_api, "PIP_VERSION")
+    monkeypatch.setattr(pip_api.aio, "version", fake_version)
+
+    asyncio.run(pip_api.aio.installed_distributions(native=True, timeout=30))
+
+    assert timeouts == [30]
@@ -0,0 +1,409 @@
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pretend
+import pytest
+
+import pip_api.aio
+from pip_api import _call, _worker
+from pip_api.exceptions import InvalidArguments, PipTimeout
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setenv("PIPAPI_WORKER", "1")
+    _call._stop_workers()
+    yield
+    _call._stop_workers()
+
+
+def _worker_pid():
+    (worker,) = _call._workers.values()
+    return worker.process.pid if worker.process is not None else None
+
+
+def test_call_worker(worker):
+    result = _call.call("--version")
+
+    assert result == subprocess.check_output(_call.command(["--version"])).decode()
+
+    pid = _worker_pid()
+    assert pid is not None
+    _call.call("--version")
+    assert _worker_pid() == pid
+
+
+@pytest.mark.parametrize("value", ["0", "false", "No", ""])
+def test_call_worker_disabled(monkeypatch, value):
+    monkeypatch.setenv("PIPAPI_WORKER", value)
+    _call._stop_workers()
+
+    _call.call("--version")
+
+    assert not _call._workers
+
+
+def test_call_worker_invalid(monkeypatch):
+    monkeypatch.setenv("PIPAPI_WORKER", "maybe")
+
+    with pytest.raises(InvalidArguments):
+        _call.call("--version")
+
+
+def test_call_worker_fails(worker):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        _call.call("not-a-command")
+
+    assert e.value.returncode == 1
+    assert e.value.cmd == _call.command(["not-a-command"])
+
+    # The worker is still usable
+    assert _call.call("--version").startswith("pip ")
+
+
+def test_call_worker_relative_cwd(worker, monkeypatch, tmpdir):
+    tmpdir.mkdir("sub").join("a.txt").write("foo")
+    monkeypatch.chdir(tmpdir)
+
+    result = _call.call("hash", "a.txt", cwd="sub")
+
+    assert result.startswith("a.txt:\n--hash=sha256:")
+
+
+def test_call_worker_cwd_and_environment(worker, monkeypatch, tmpdir):
+    tmpdir.join("a.txt").write("foo")
+
+    # Relative paths are relative to each call's working directory
+    result = _call.call("hash", "a.txt", cwd=str(tmpdir))
+    assert result.startswith("a.txt:\n--hash=sha256:")
+
+    # Each call sees the environment at the time it was made
+    monkeypatch.setenv("PIP_ALGORITHM", "sha512")
+    result = _call.call("hash", "a.txt", cwd=str(tmpdir))
+    assert result.startswith("a.txt:\n--hash=sha512:")
+
+    monkeypatch.delenv("PIP_ALGORITHM")
+    result = _call.call("hash", "a.txt", cwd=str(tmpdir))
+    assert result.startswith("a.txt:\n--hash=sha256:")
+
+
+def test_call_worker_max_calls(worker, monkeypatch):
+    monkeypatch.setenv("PIPAPI_WORKER_MAX_CALLS", "2")
+
+    _call.call("--version")
+    pid = _worker_pid()
+    _call.call("--version")
+
+    # The worker is replaced after two calls
+    assert _worker_pid() is None
+    _call.call("--version")
+    assert _worker_pid() not in (None, pid)
+
+
+def test_call_worker_max_calls_invalid(worker, monkeypatch):
+    monkeypatch.setenv("PIPAPI_WORKER_MAX_CALLS", "lots")
+
+    with pytest.raises(InvalidArguments):
+        _call.call("--version")
+
+
+def test_call_worker_restarts(worker):
+    _call.call("--version")
+    (worker,) = _call._workers.values()
+    worker.process.kill()
+    worker.process.wait()
+
+    assert _call.call("--version").startswith("pip ")
+
+
+def test_call_worker_busy(worker, monkeypatch):
+    _call.call("--version")
+    (worker,) = _call._workers.values()
+
+    calls = []
+    check_output = _call.check_output
+
+    def record_check_output(*args, **kwargs):
+        calls.append(args)
+        return check_output(*args, **kwargs)
+
+    monkeypatch.setattr(_call, "check_output", record_check_output)
+
+    # If the worker is busy, fall back on running pip directly
+    with worker.lock:
+        assert _call.call("--version").startswith("pip ")
+
+    assert len(calls) == 1
+
+
+def test_call_worker_startup_changed(worker, monkeypatch, tmpdir):
+    site_packages = tmpdir.mkdir("site-packages")
+    site_packages.mkdir("fakedist-1.0.dist-info").join("METADATA").write(
+        "Name: fakedist\nVersion: 1.0\n"
+    )
+
+    def names(**kwargs):
+        return {
+            dist["name"]
+            for dist in json.loads(_call.call("list", "--format=json", **kwargs))
+        }
+
+    assert "fakedist" not in names()
+    pid = _worker_pid()
+
+    # A worker started before PYTHONPATH changed can't see the new path, and
+    # relative entries are relative to each call's working directory
+    monkeypatch.setenv("PYTHONPATH", "site-packages")
+    assert "fakedist" in names(cwd=str(tmpdir))
+    assert _worker_pid() != pid
+
+    pid = _worker_pid()
+    assert "fakedist" in names(cwd=str(tmpdir))
+    assert _worker_pid() == pid
+    assert "fakedist" not in names()
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_call_worker_unavailable(worker, monkeypatch, tmpdir):
+    # An interpreter which can't import pip
+    python = tmpdir.join("python")
+    python.write('#!/bin/sh\nexec {} -S -I "$@"\n'.format(sys.executable))
+    python.chmod(0o755)
+
+    calls = []
+    monkeypatch.setattr(
+        _call, "check_output", lambda *args, **kwargs: calls.append(args) or b""
+    )
+
+    _call.call("--version", python_location=str(python))
+    _call.call("--version", python_location=str(python))
+
+    assert len(calls) == 2
+    assert _call._workers[str(python)].unavailable
+
+
+def test_worker_run_in_process(capsys):
+    from pip._internal.cli.main import main
+
+    environ = dict(os.environ)
+    request = {"args": ["--version"], "cwd": None, "env": _call.environment()}
+
+    returncode, output, usage = _worker.run_in_process(main, request)
+
+    assert returncode == 0
+    assert output.decode().startswith("pip ")
+    assert usage is None
+    assert dict(os.environ) == environ
+
+
+def _script(tmpdir, body):
+    script = tmpdir.join("python")
+    script.write("#!/bin/sh\n" + body)
+    script.chmod(0o755)
+    return str(script)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_call_timeout(tmpdir):
+    # Something pip starts which outlives it
+    python = _script(
+        tmpdir, "(sleep 1; touch {}) &\nsleep 60\n".format(tmpdir.join("orphan"))
+    )
+
+    start = time.monotonic()
+    with pytest.raises(PipTimeout) as e:
+        _call.call("install", "something", python_location=python, timeout=0.5)
+
+    assert time.monotonic() - start < 5
+    assert isinstance(e.value, subprocess.TimeoutExpired)
+    assert e.value.cmd == [python, "-m", "pip", "install", "something"]
+    assert e.value.timeout == 0.5
+
+    # Everything in pip's process group was killed
+    time.sleep(1.5)
+    assert not tmpdir.join("orphan").exists()
+
+
+@pytest.fixture
+def stalled_index():
+    # An index which accepts connections but never responds
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    yield "http://127.0.0.1:{}/simple/".format(server.getsockname()[1])
+    server.close()
+
+
+def test_call_worker_timeout(worker, stalled_index, tmpdir):
+    _call.call("--version")
+    pid = _worker_pid()
+
+    with pytest.raises(PipTimeout):
+        _call.call(
+            "download",
+            "--no-cache-dir",
+            "--retries=0",
+            "--timeout=60",
+            "--index-url",
+            stalled_index,
+            "--dest",
+            str(tmpdir),
+            "something",
+            timeout=1,
+        )
+
+    # The worker was killed, and is replaced on the next call
+    assert _worker_pid() is None
+    assert _call.call("--version").startswith("pip ")
+    assert _worker_pid() not in (None, pid)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_call_resource_limits(monkeypatch, tmpdir):
+    python = _script(tmpdir, "ulimit -t\nulimit -v\n")
+    monkeypatch.setenv("PIPAPI_MAX_CPU_TIME", "30")
+    monkeypatch.setenv("PIPAPI_MAX_MEMORY", str(2**30))
+    popen_kwargs = []
+    popen = subprocess.Popen
+
+    def fake_popen(*args, **kwargs):
+        popen_kwargs.append(kwargs)
+        return popen(*args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", fake_popen)
+
+    result = _call.call("--version", python_location=python)
+
+    assert result.split() == ["30", str(2**20)]
+    # Running Python in the forked child isn't safe in a threaded program
+    assert "preexec_fn" not in popen_kwargs[0]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_aio_call_resource_limits(monkeypatch, tmpdir):
+    python = _script(tmpdir, "ulimit -t\n")
+    monkeypatch.setenv("PIPAPI_MAX_CPU_TIME", "30")
+
+    result = asyncio.run(pip_api.aio.call("--version", python_location=python))
+
+    assert result.split() == ["30"]
+
+
+def test_call_resource_limits_invalid(monkeypatch):
+    monkeypatch.setenv("PIPAPI_MAX_MEMORY", "1G")
+
+    with pytest.raises(InvalidArguments):
+        _call.call("--version")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires fork")
+def test_worker_run_in_child_resource_limits():
+    import resource
+
+    def main(args):
+        print(resource.getrlimit(resource.RLIMIT_CPU)[0])
+
+    request = {
+        "args": [],
+        "cwd": None,
+        "env": dict(os.environ),
+        "limits": {"RLIMIT_CPU": 30},
+    }
+
+    returncode, output, usage = _worker.run_in_child(main, request)
+
+    assert returncode == 0
+    assert output.decode() == "30\n"
+    assert usage["max_rss"] > 0
+    assert resource.getrlimit(resource.RLIMIT_CPU)[0] != 30
+
+
+def test_stream():
+    assert "".join(_call.stream("--version")) == _call.call("--version")
+
+
+def test_stream_fails():
+    output = []
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        output.extend(_call.stream("not-a-command"))
+
+    assert e.value.returncode == 1
+    assert e.value.cmd == _call.command(["not-a-command"])
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_stream_lines(tmpdir):
+    python = _script(tmpdir, "echo one\nsleep 60\necho two\n")
+
+    start = time.monotonic()
+    lines = _call.stream("install", python_location=python)
+
+    # Output is yielded as soon as it's written
+    assert next(lines) == "one\n"
+
+    # Closing the stream early kills pip
+    lines.close()
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_stream_chunks(tmpdir):
+    python = _script(tmpdir, "printf 'ab\\303\\251cd\\n'\n")
+
+    chunks = list(_call.stream("list", python_location=python, chunk_size=1))
+
+    # Characters split across chunks are decoded whole
+    assert "".join(chunks) == "abécd\n"
+    assert len(chunks) == 6
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_stream_timeout(tmpdir):
+    python = _script(tmpdir, "echo one\nsleep 60\n")
+
+    lines = []
+    with pytest.raises(PipTimeout):
+        lines.extend(_call.stream("install", python_location=python, timeout=0.5))
+
+    assert lines == ["one\n"]
+
+
+def test_worker_read_message_truncated():
+    message = io.BytesIO()
+    _worker.write_message(message, {"output": "x" * 100})
+
+    truncated = io.BytesIO(message.getvalue()[:50])
+
+    assert _worker.read_message(truncated) is None
+
+
+def test_call_worker_timeout_during_response(monkeypatch):
+    # The worker is killed after starting to send a large response
+    message = io.BytesIO()
+    _worker.write_message(message, {"returncode": 0, "output": "x" * 100000})
+
+    worker = _call._Worker(sys.executable)
+    worker.process = pretend.stub(
+        stdin=io.BytesIO(),
+        stdout=io.BytesIO(message.getvalue()[:65536]),
+        returncode=None,
+        poll=lambda: None,
+        wait=lambda: 0,
+    )
+    worker.startup = _call._startup()
+    monkeypatch.setattr(
+        _call,
+        "_Deadline",
+        lambda process, timeout: pretend.stub(expired=True, cancel=lambda: None),
+    )
+
+    with pytest.raises(PipTimeout):
+        worker.call(["list"], timeout=1)
+
+    assert worker.process is None
@@ -1,6 +1,23 @@
+import os
+import subprocess
+import sys
+
+import pretend
 import pytest
 
 import pip_api
+from pip_api._hash import BUFFER_SIZE
+
+
+def test_import_does_not_import_sqlite3():
+    # Only the opt-in HashCache needs sqlite3
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-c",
+            "import sys, pip_api; assert 'sqlite3' not in sys.modules",
+        ]
+    )
 
 
 @pytest.mark.parametrize(
@@ -17,8 +34,11 @@ import pip_api
         ),
     ],
 )
-def test_hash(some_distribution, algorithm, expected):
-    result = pip_api.hash(some_distribution.filename, algorithm=algorithm)
+@pytest.mark.parametrize("use_subprocess", [True, False])
+def test_hash(some_distribution, algorithm, expected, use_subprocess):
+    result = pip_api.hash(
+        some_distribution.filename, algorithm=algorithm, use_subprocess=use_subprocess
+    )
 
     assert result == expected
 
@@ -32,3 +52,158 @@ def test_hash_default_algorithm_is_256(some_distribution):
 def test_hash_invalid_algorithm():
     with pytest.raises(pip_api.exceptions.InvalidArguments):
         pip_api.hash("whatever", "invalid")
+
+
+@pytest.mark.parametrize("size", [0, 1, BUFFER_SIZE, BUFFER_SIZE * 2 + 1])
+def test_hash_matches_pip(tmpdir, size):
+    filename = tmpdir.join("file")
+    filename.write_binary(os.urandom(size))
+
+    assert pip_api.hash(filename) == pip_api.hash(filename, use_subprocess=True)
+
+
+def test_hash_missing_file(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        pip_api.hash(tmpdir.join("missing"))
+
+
+def test_hash_many(data):
+    filenames = [
+        data.join("dummyproject-0.0.1-py3-none-any.whl"),
+        data.join("fakeproject-1.0-py3-none-any.whl"),
+    ]
+
+    results = {
+        result.filename: result
+        for result in pip_api.hash_many(
+            filenames, algorithms=("sha256", "sha512"), workers=2
+        )
+    }
+
+    assert set(results) == set(filenames)
+    for filename in filenames:
+        assert results[filename].hashes == {
+            "sha256": pip_api.hash(filename, "sha256"),
+            "sha512": pip_api.hash(filename, "sha512"),
+        }
+        assert results[filename].options() == [
+            "--hash=sha256:" + pip_api.hash(filename, "sha256"),
+            "--hash=sha512:" + pip_api.hash(filename, "sha512"),
+        ]
+
+
+def test_hash_many_missing_file(data, tmpdir):
+    filenames = [
+        data.join("dummyproject-0.0.1-py3-none-any.whl"),
+        tmpdir.join("missing"),
+    ]
+
+    with pytest.raises(FileNotFoundError):
+        list(pip_api.hash_many(filenames))
+
+
+def test_hash_many_invalid_algorithm():
+    with pytest.raises(pip_api.exceptions.InvalidArguments):
+        list(pip_api.hash_many(["whatever"], algorithms=("sha256", "md5")))
+
+
+@pytest.fixture
+def hash_cache(tmpdir):
+    cache = pip_api.HashCache(str(tmpdir.join("hashes.sqlite3")))
+    yield cache
+    cache.close()
+
+
+def test_hash_cache(monkeypatch, tmpdir, hash_cache):
+    filename = tmpdir.join("file")
+    filename.write_binary(b"contents")
+    expected = pip_api.hash(filename)
+
+    assert pip_api.hash(filename, cache=hash_cache) == expected
+    assert (hash_cache.hits, hash_cache.misses) == (0, 1)
+
+    # A cached hash shouldn't require reading the file again
+    monkeypatch.setattr(
+        pip_api._hash, "_hash_file", pretend.raiser(AssertionError("read"))
+    )
+    assert pip_api.hash(filename, cache=hash_cache) == expected
+    assert (hash_cache.hits, hash_cache.misses) == (1, 1)
+
+
+def test_hash_cache_file_changed(tmpdir, hash_cache):
+    filename = tmpdir.join("file")
+    filename.write_binary(b"contents")
+    pip_api.hash(filename, cache=hash_cache)
+
+    filename.write_binary(b"different contents")
+
+    assert pip_api.hash(filename, cache=hash_cache) == pip_api.hash(filename)
+    assert (hash_cache.hits, hash_cache.misses) == (0, 2)
+
+
+def test_hash_cache_persists(tmpdir, hash_cache):
+    filename = tmpdir.join("file")
+    filename.write_binary(b"contents")
+    pip_api.hash(filename, cache=hash_cache)
+
+    other_cache = pip_api.HashCache(hash_cache.path)
+    try:
+        assert pip_api.hash(filename, cache=other_cache) == pip_api.hash(filename)
+        assert (other_cache.hits, other_cache.misses) == (1, 0)
+    finally:
+        other_cache.close()
+
+
+def test_hash_cache_hits_rarely_write(monkeypatch, tmpdir, hash_cache):
+    filename = tmpdir.join("file")
+    filename.write_binary(b"contents")
+    pip_api.hash(filename, cache=hash_cache)
+
+    statements = []
+    hash_cache._connection.set_trace_callback(statements.append)
+
+    # A recently used entry isn't written to on a hit
+    pip_api.hash(filename, cache=hash_cache)
+    assert not [s for s in statements if s.startswith("UPDATE")]
+
+    # But one which hasn't been used for a while is
+    monkeypatch.setattr(pip_api.HashCache, "LAST_USED_INTERVAL", 0)
+    pip_api.hash(filename, cache=hash_cache)
+    assert [s for s in statements if s.startswith("UPDATE")]
+    assert (hash_cache.hits, hash_cache.misses) == (2, 1)
+
+
+def test_hash_cache_eviction(monkeypatch, tmpdir):
+    monkeypatch.setattr(pip_api.HashCache, "EVICTION_INTERVAL", 1)
+    cache = pip_api.HashCache(str(tmpdir.join("hashes.sqlite3")), max_entries=2)
+
+    filenames = []
+    for i in range(3):
+        filename = tmpdir.join("file{}".format(i))
+        filename.write_binary(b"contents")
+        filenames.append(filename)
+        pip_api.hash(filename, cache=cache)
+
+    # The least recently used entry should have been evicted
+    assert pip_api.hash(filenames[2], cache=cache)
+    assert pip_api.hash(filenames[1], cache=cache)
+    assert pip_api.hash(filenames[0], cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+    cache.close()
+
+
+def test_hash_many_cache(data, hash_cache):
+    filenames = [
+        data.join("dummyproject-0.0.1-py3-none-any.whl"),
+        data.join("fakeproject-1.0-py3-none-any.whl"),
+    ]
+
+    first = {
+        r.filename: r.hashes for r in pip_api.hash_many(filenames, cache=hash_cache)
+    }
+    second = {
+        r.filename: r.hashes for r in pip_api.hash_many(filenames, cache=hash_cache)
+    }
+
+    assert first == second
+    assert (hash_cache.hits, hash_cache.misses) == (2, 2)
@@ -1,9 +1,12 @@
 import os
+import time
 
 import pytest
 
 import pip_api
+from pip_api._installed_distributions import _iter_json_array
 from pip_api._vendor.packaging_legacy.version import parse
+from pip_api.exceptions import PipTimeout
 
 
 def test_installed_distributions(pip, some_distribution):
@@ -82,9 +85,9 @@ def test_installed_distributions_local(monkeypatch, pip):
     # invocation.
     original_call = pip_api._installed_distributions.call
 
-    def mock_call(*args, cwd=None):
+    def mock_call(*args, **kwargs):
         assert "--local" in args
-        return original_call(*args, cwd=cwd)
+        return original_call(*args, **kwargs)
 
     monkeypatch.setattr(pip_api._installed_distributions, "call", mock_call)
 
@@ -138,3 +141,291 @@ def test_installed_distributions_multiple_paths(
     distributions = pip_api.installed_distributions(paths=[target, other_target])
     assert some_distribution.name in distributions
     assert other_distribution.name in distributions
+
+
+def _summarize(distributions):
+    return {
+        name: (
+            str(dist.version),
+            dist.location,
+            dist.editable_project_location,
+            dist.editable,
+        )
+        for name, dist in distributions.items()
+    }
+
+
+def test_installed_distributions_native_parity(
+    pip, other_distribution, some_editable_distribution
+):
+    pip.run("install", other_distribution.filename)
+    pip.run("install", "--editable", some_editable_distribution.filename)
+
+    from_pip = pip_api.installed_distributions()
+    from_native = pip_api.installed_distributions(native=True)
+
+    assert other_distribution.name in from_native
+    assert from_native[some_editable_distribution.name].editable
+    assert list(from_native) == list(from_pip)
+    assert _summarize(from_native) == _summarize(from_pip)
+
+
+def test_installed_distributions_native_paths_parity(pip, some_distribution, target):
+    pip.run("install", "--target", target, some_distribution.filename)
+
+    from_pip = pip_api.installed_distributions(paths=[target])
+    from_native = pip_api.installed_distributions(paths=[target], native=True)
+
+    assert _summarize(from_native) == _summarize(from_pip)
+
+
+def test_iter_installed_distributions(
+    pip, some_distribution, some_editable_distribution, target
+):
+    pip.run("install", some_distribution.filename)
+    pip.run("install", "--editable", some_editable_distribution.filename)
+
+    distributions = pip_api.iter_installed_distributions()
+
+    assert not isinstance(distributions, dict)
+    assert _summarize({dist.name: dist for dist in distributions}) == _summarize(
+        pip_api.installed_distributions()
+    )
+
+    pip.run("install", "--target", target, some_distribution.filename)
+    assert [
+        dist.name for dist in pip_api.iter_installed_distributions(paths=[target])
+    ] == [some_distribution.name]
+
+
+def test_iter_installed_distributions_call_pool(monkeypatch):
+    # Make sure the real version is computed, so that it's restored afterwards
+    pip_api.PIP_VERSION
+    monkeypatch.delattr(pip_api, "PIP_VERSION")
+    # Make finding pip's version call out to pip
+    monkeypatch.setattr(pip_api._version, "_known_version", lambda key: None)
+    pool = pip_api.CallPool(max_concurrency=1, max_wait=10)
+    previous = pip_api.set_call_pool(pool)
+
+    try:
+        distributions = list(pip_api.iter_installed_distributions())
+    finally:
+        pip_api.set_call_pool(previous)
+
+    assert {dist.name for dist in distributions} == set(
+        pip_api.installed_distributions()
+    )
+    assert pool.metrics()["calls"] == 2
+    assert pool.metrics()["rejected"] == 0
+
+
+def test_iter_json_array():
+    document = ' [{"a": [1, "]"]}, 123 ,4.5e1,"x,]", null, {}]\n'
+    expected = [{"a": [1, "]"]}, 123, 45.0, "x,]", None, {}]
+
+    # However the document is split into chunks
+    for size in range(1, len(document) + 1):
+        chunks = [document[i : i + size] for i in range(0, len(document), size)]
+        assert list(_iter_json_array(chunks)) == expected
+
+    assert list(_iter_json_array(["[", " ]"])) == []
+
+
+@pytest.mark.parametrize("document", ["", "{}", "[1", "[1,", "[1 2]", "[1,]", "[,]"])
+def test_iter_json_array_invalid(document):
+    with pytest.raises(ValueError):
+        list(_iter_json_array(document))
+
+
+def test_installed_distributions_native_metadata(tmpdir):
+    site_packages = tmpdir.mkdir("site-packages")
+
+    regular = site_packages.mkdir("regular-1.0.dist-info")
+    regular.join("METADATA").write("Name: Regular\nVersion: 1.0.0-1\n\nBody: x\n")
+
+    editable = site_packages.mkdir("editable-2.0.dist-info")
+    editable.join("METADATA").write("Name: editable\nVersion: 2.0\n")
+    editable.join("direct_url.json").write(
+        '{"url": "file:///src/editable", "dir_info": {"editable": true}}'
+    )
+
+    project = tmpdir.mkdir("legacy")
+    project.mkdir("legacy.egg-info").join("PKG-INFO").write(
+        "Name: legacy\nVersion: 3.0\n"
+    )
+    site_packages.join("legacy.egg-link").write(str(project) + "\n.\n")
+
+    distributions = pip_api.installed_distributions(paths=[site_packages], native=True)
+
+    assert list(distributions) == ["editable", "legacy", "Regular"]
+    assert str(distributions["Regular"].version) == "1.0.0.post1"
+    assert distributions["Regular"].location == str(site_packages)
+    assert not distributions["Regular"].editable
+    assert distributions["editable"].editable_project_location == os.path.normpath(
+        "/src/editable"
+    )
+    assert distributions["editable"].editable
+    assert distributions["legacy"].location == str(project)
+
+
+def test_installed_distributions_native_interpreter_timeout(tmpdir):
+    python = tmpdir.join("python")
+    python.write("#!/bin/sh\nsleep 60\n")
+    python.chmod(0o755)
+    pool = pip_api.CallPool(max_concurrency=1)
+    records = []
+    previous = pip_api.set_call_pool(pool)
+    pip_api.add_call_observer(records.append)
+    start = time.monotonic()
+
+    try:
+        with pytest.raises(PipTimeout):
+            pip_api.installed_distributions(
+                native=True, python_location=str(python), timeout=0.5
+            )
+    finally:
+        pip_api.remove_call_observer(records.append)
+        pip_api.set_call_pool(previous)
+
+    assert time.monotonic() - start < 30
+    assert pool.metrics()["calls"] == 1
+    assert pool.metrics()["running"] == 0
+    assert [record.argv[0] for record in records] == [str(python)]
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_installed_distributions_pip_version_timeout(monkeypatch, native):
+    # Make sure the real version is computed, so that it's restored afterwards
+    real_version = str(pip_api.PIP_VERSION)
+    timeouts = []
+
+    def fake_version(timeout=None):
+        timeouts.append(timeout)
+        return real_version
+
+    monkeypatch.delattr(pip_api, "PIP_VERSION")
+    monkeypatch.setattr(pip_api, "version", fake_version)
+
+    pip_api.installed_distributions(native=native, timeout=30)
+
+    assert timeouts == [30]
+
+
+def test_installed_distributions_native_paths_and_local():
+    with pytest.raises(pip_api.exceptions.InvalidArguments):
+        pip_api.installed_distributions(local=True, paths=["."], native=True)
+
+
+def test_installed_distributions_native_incremental(monkeypatch, tmpdir):
+    site_packages = tmpdir.mkdir("site-packages")
+
+    def add(name, version):
+        info = site_packages.mkdir("{}-{}.dist-info".format(name, version))
+        info.join("METADATA").write("Name: {}\nVersion: {}\n".format(name, version))
+        return info
+
+    def bump_mtime():
+        # Make sure the directory's modification time changes, regardless of
+        # the resolution of the filesystem's timestamps
+        stat = os.stat(str(site_packages))
+        os.utime(str(site_packages), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    add("foo", "1.0")
+    bar = add("bar", "1.0")
+
+    reads = []
+    original_read_entry = pip_api._installed_distributions._read_entry
+
+    def counting_read_entry(path, mtime_ns):
+        reads.append(os.path.basename(path))
+        return original_read_entry(path, mtime_ns)
+
+    monkeypatch.setattr(
+        pip_api._installed_distributions, "_read_entry", counting_read_entry
+    )
+
+    first = pip_api.installed_distributions(paths=[site_packages], native=True)
+    assert list(first) == ["bar", "foo"]
+    assert sorted(reads) == ["bar-1.0.dist-info", "foo-1.0.dist-info"]
+
+    # Nothing has changed, so nothing should be read again
+    reads.clear()
+    second = pip_api.installed_distributions(paths=[site_packages], native=True)
+    assert reads == []
+    assert _summarize(second) == _summarize(first)
+
+    # Each caller gets its own copies
+    assert second["foo"] is not first["foo"]
+    second["foo"].version = parse("9.9")
+    assert pip_api.installed_distributions(paths=[site_packages], native=True)[
+        "foo"
+    ].version == parse("1.0")
+
+    # Only the added distribution should be read
+    add("baz", "2.0")
+    bar.remove()
+    bump_mtime()
+    third = pip_api.installed_distributions(paths=[site_packages], native=True)
+    assert reads == ["baz-2.0.dist-info"]
+    assert list(third) == ["baz", "foo"]
+
+
+def test_installed_distributions_native_relative_path(monkeypatch, tmpdir):
+    for name in ["foo", "bar"]:
+        site_packages = tmpdir.mkdir(name).mkdir("site-packages")
+        info = site_packages.mkdir("{}-1.0.dist-info".format(name))
+        info.join("METADATA").write("Name: {}\nVersion: 1.0\n".format(name))
+        # Both directories look unchanged to a cache which only checks mtimes
+        os.utime(str(site_packages), ns=(0, 10**18))
+
+    monkeypatch.chdir(tmpdir.join("foo"))
+    foo = pip_api.installed_distributions(paths=["site-packages"], native=True)
+    monkeypatch.chdir(tmpdir.join("bar"))
+    bar = pip_api.installed_distributions(paths=["site-packages"], native=True)
+
+    assert list(foo) == ["foo"]
+    assert list(bar) == ["bar"]
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_installed_distributions_many(
+    pip, some_distribution, other_distribution, tmpdir, native
+):
+    venv_python = os.environ["PIPAPI_PYTHON_LOCATION"]
+    target = tmpdir.mkdir("target")
+    missing_python = str(tmpdir.join("missing", "python"))
+
+    pip.run("install", some_distribution.filename)
+    pip.run("install", "--target", target, other_distribution.filename)
+
+    results = pip_api.installed_distributions_many(
+        [venv_python, [target], missing_python], native=native, workers=2
+    )
+
+    assert list(results) == [venv_python, (target,), missing_python]
+
+    assert results[venv_python].error is None
+    assert some_distribution.name in results[venv_python].distributions
+    assert other_distribution.name not in results[venv_python].distributions
+
+    assert results[(target,)].error is None
+    assert list(results[(target,)].distributions) == [other_distribution.name]
+
+    assert results[missing_python].distributions is None
+    assert isinstance(results[missing_python].error, OSError)
+
+    assert all(result.duration >= 0 for result in results.values())
+
+
+def test_lru_cache():
+    cache = pip_api._cache.LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is now the least recently used
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
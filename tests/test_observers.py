@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import subprocess
+
+import pretend
+import pytest
+
+import pip_api
+import pip_api.aio
+from pip_api import _call
+
+
+@pytest.fixture
+def records():
+    records = []
+    pip_api.add_call_observer(records.append)
+    yield records
+    pip_api.remove_call_observer(records.append)
+
+
+def _record(argv=("python", "-m", "pip", "install"), returncode=0, **kwargs):
+    return pip_api.CallRecord(
+        list(argv),
+        None,
+        kwargs.pop("start", 10.0),
+        kwargs.pop("end", 12.0),
+        returncode,
+        kwargs.pop("output_bytes", 100),
+        kwargs.pop("usage", None),
+    )
+
+
+def test_observe_call(records, tmpdir):
+    result = _call.call("--version", cwd=tmpdir)
+
+    (record,) = records
+    assert record.argv == _call.command(["--version"])
+    assert record.command == "--version"
+    assert record.cwd == str(tmpdir)
+    assert record.returncode == 0
+    assert record.output_bytes == len(result.encode())
+    assert 0 < record.duration == record.end - record.start
+    assert not record.worker
+    if hasattr(os, "wait4"):
+        assert record.user_time > 0
+        assert record.system_time >= 0
+        assert record.max_rss > 0
+
+
+def test_observe_call_fails(records):
+    with pytest.raises(subprocess.CalledProcessError):
+        _call.call("not-a-command")
+
+    (record,) = records
+    assert record.returncode == 1
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_observe_stream_closed(records, tmpdir):
+    python = tmpdir.join("python")
+    python.write("#!/bin/sh\necho one\nsleep 60\n")
+    python.chmod(0o755)
+
+    lines = _call.stream("install", python_location=str(python))
+    assert next(lines) == "one\n"
+    assert not records
+    lines.close()
+
+    (record,) = records
+    assert record.returncode < 0
+    assert record.output_bytes == 4
+
+
+def test_observe_worker(records, monkeypatch):
+    monkeypatch.setenv("PIPAPI_WORKER", "1")
+    _call._stop_workers()
+    try:
+        _call.call("--version")
+    finally:
+        _call._stop_workers()
+
+    (record,) = records
+    assert record.worker
+    assert record.returncode == 0
+    if hasattr(os, "fork"):
+        assert record.max_rss > 0
+
+
+def test_observe_aio_call(records):
+    result = asyncio.run(pip_api.aio.call("--version"))
+
+    (record,) = records
+    assert record.argv == _call.command(["--version"])
+    assert record.output_bytes == len(result.encode())
+    assert record.max_rss is None
+
+
+def test_no_observers(monkeypatch):
+    # Without observers, no resource usage is collected
+    monkeypatch.setattr(
+        os, "wait4", pretend.raiser(AssertionError("wait4 called")), raising=False
+    )
+
+    assert _call.call("--version").startswith("pip ")
+
+
+def test_remove_call_observer():
+    records = []
+    pip_api.add_call_observer(records.append)
+    pip_api.remove_call_observer(records.append)
+
+    _call.call("--version")
+
+    assert not records
+    with pytest.raises(ValueError):
+        pip_api.remove_call_observer(records.append)
+
+
+def test_call_stats():
+    stats = pip_api.CallStats()
+
+    stats(_record(usage={"user_time": 1.0, "system_time": 0.5, "max_rss": 100}))
+    stats(_record(returncode=1, end=15.0, output_bytes=50))
+    stats(_record(argv=["python", "-m", "pip", "list"]))
+
+    assert stats.metrics() == {
+        "install": {
+            "calls": 2,
+            "failures": 1,
+            "duration_total": 7.0,
+            "duration_max": 5.0,
+            "user_time_total": 1.0,
+            "system_time_total": 0.5,
+            "max_rss_max": 100,
+            "output_bytes_total": 150,
+        },
+        "list": {
+            "calls": 1,
+            "failures": 0,
+            "duration_total": 2.0,
+            "duration_max": 2.0,
+            "user_time_total": 0.0,
+            "system_time_total": 0.0,
+            "max_rss_max": 0,
+            "output_bytes_total": 100,
+        },
+    }
+    assert repr(stats) == "<CallStats(commands=['install', 'list'])>"
+
+
+def test_json_lines_exporter(tmpdir):
+    path = tmpdir.join("calls.jsonl")
+    path.write('{"existing": true}\n')
+
+    exporter = pip_api.JSONLinesExporter(str(path))
+    exporter(_record())
+    exporter(_record(returncode=None))
+    exporter.close()
+
+    lines = [json.loads(line) for line in path.readlines()]
+    assert lines[0] == {"existing": True}
+    assert lines[1] == {
+        "argv": ["python", "-m", "pip", "install"],
+        "cwd": None,
+        "start": 10.0,
+        "end": 12.0,
+        "returncode": 0,
+        "output_bytes": 100,
+        "user_time": None,
+        "system_time": None,
+        "max_rss": None,
+        "worker": False,
+    }
+    assert lines[2]["returncode"] is None
+
+
+@pytest.fixture
+def broken_observer():
+    def observer(record):
+        raise ValueError("broken")
+
+    pip_api.add_call_observer(observer)
+    yield observer
+    pip_api.remove_call_observer(observer)
+
+
+def test_observer_fails(broken_observer, records):
+    with pytest.warns(RuntimeWarning, match="broken"):
+        result = _call.call("--version")
+
+    assert result
+    # Later observers still see the call
+    assert len(records) == 1
+
+
+def test_observer_fails_call_fails(broken_observer):
+    with pytest.warns(RuntimeWarning, match="broken"):
+        with pytest.raises(subprocess.CalledProcessError):
+            _call.call("not-a-command")
+
+
+def test_observer_fails_aio(broken_observer):
+    with pytest.warns(RuntimeWarning, match="broken"):
+        with pytest.raises(subprocess.CalledProcessError):
+            asyncio.run(pip_api.aio.call("not-a-command"))
@@ -1,5 +1,8 @@
 import os
+import threading
+import time
 
+import pretend
 import pytest
 
 import pip_api
@@ -397,3 +400,570 @@ def test_parse_requirements_missing_all_hashes_strict(monkeypatch):
         PipError, match=r"Missing hashes for requirement in a\.txt, line 1"
     ):
         pip_api.parse_requirements("a.txt", strict_hashes=True)
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "foo==1.2.3",
+        "foo==1.2.3 --hash=sha256:abc --hash sha256:def",
+        "-r b.txt",
+        "--requirement=b.txt",
+        "-rb.txt",
+        "-r=b.txt",
+        "--req b.txt",
+        "-e ./foo",
+        "--edit=./foo",
+        "-i https://example.com/simple foo",
+        "--index https://example.com/simple",
+        "--extra https://example.com/simple foo",
+        "foo --unknown bar",
+        "foo bar --pre baz",
+        "foo -- -r b.txt",
+        "-- foo",
+        "foo - -1 -.5",
+        "-r a.txt -r b.txt",
+        "",
+    ],
+)
+def test_tokenize_matches_argparse(line):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("req", nargs="*")
+    parser.add_argument("-r", "--requirement")
+    parser.add_argument("-e", "--editable")
+    parser.add_argument("-i", "--index-url")
+    parser.add_argument("--extra-index-url")
+    parser.add_argument("-f", "--find-links")
+    parser.add_argument("--hash", action="append", dest="hashes")
+    parser.add_argument("--trusted-host")
+
+    expected, _ = parser.parse_known_args(line.split())
+    result = pip_api._parse_requirements._tokenize(line)
+
+    for attribute in pip_api._parse_requirements._LineOptions.__slots__:
+        assert getattr(result, attribute) == getattr(expected, attribute)
+
+
+@pytest.mark.parametrize(
+    "line, match",
+    [
+        ("-r", r"argument -r: expected one argument"),
+        ("--hash --pre", r"argument --hash: expected one argument"),
+        ("--e b.txt", r"ambiguous option: --e could match"),
+    ],
+)
+def test_parse_requirements_invalid_options(monkeypatch, line, match):
+    files = {"a.txt": [line + "\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    with pytest.raises(PipError, match=match):
+        pip_api.parse_requirements("a.txt")
+
+
+def test_iter_requirements(monkeypatch):
+    files = {
+        "a.txt": ["foo==1.2.3\n", "-r b.txt\n", "-r c.txt\n", "bar==1.2.3\n"],
+        "b.txt": ["baz==1.2.3\n", "-r c.txt\n"],
+        "c.txt": ["qux==1.2.3\n", "-r a.txt\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    result = pip_api.iter_requirements("a.txt")
+
+    assert [(req.name, req.filename) for req in result] == [
+        ("foo", "a.txt"),
+        ("bar", "a.txt"),
+        ("baz", "b.txt"),
+        ("qux", "c.txt"),
+    ]
+
+
+def test_iter_requirements_stops_early(monkeypatch):
+    files = {"a.txt": ["foo==1.2.3\n", "-r b.txt\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    result = pip_api.iter_requirements("a.txt")
+
+    # b.txt doesn't exist, but is never read
+    assert str(next(result)) == "foo==1.2.3"
+
+
+@pytest.mark.parametrize("check_duplicates", [True, False])
+def test_iter_requirements_duplicates(monkeypatch, check_duplicates):
+    files = {"a.txt": ["foo==1.2.3\n", "foo==3.2.1\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    result = pip_api.iter_requirements("a.txt", check_duplicates=check_duplicates)
+
+    assert str(next(result)) == "foo==1.2.3"
+    if check_duplicates:
+        with pytest.raises(PipError, match="Double requirement given"):
+            next(result)
+    else:
+        assert str(next(result)) == "foo==3.2.1"
+
+
+@pytest.mark.parametrize("workers", [None, -1, 0, 1, 4])
+def test_parse_requirements_workers(monkeypatch, workers):
+    files = {
+        "a.txt": ["foo==1.2.3\n", "-r b.txt\n", "-r c.txt\n", "bar==1.2.3\n"],
+        "b.txt": ["baz==1.2.3\n", "-r d.txt\n"],
+        "c.txt": ["qux==1.2.3\n", "-r a.txt\n", "-r d.txt\n"],
+        "d.txt": ["quux==1.2.3 ; python_version < '3'\n", "corge==1.2.3\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    result = pip_api.parse_requirements("a.txt", workers=workers)
+
+    assert [(name, req.comes_from) for name, req in result.items()] == [
+        ("foo", "-r a.txt (line 1)"),
+        ("bar", "-r a.txt (line 4)"),
+        ("baz", "-r b.txt (line 1)"),
+        ("qux", "-r c.txt (line 1)"),
+        ("corge", "-r d.txt (line 2)"),
+    ]
+
+
+def test_parse_requirements_workers_concurrent(monkeypatch):
+    barrier = threading.Barrier(2, timeout=5)
+    files = {"a.txt": ["-r b.txt\n", "-r c.txt\n"], "b.txt": [], "c.txt": []}
+
+    def read_file(filename):
+        if filename != "a.txt":
+            # Both included files must be read at the same time to get past this
+            barrier.wait()
+        return files[filename]
+
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", read_file)
+
+    assert pip_api.parse_requirements("a.txt", workers=2) == {}
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_iter_requirements_workers_error_order(monkeypatch, workers):
+    files = {
+        "a.txt": ["foo==1.2.3\n", "-r b.txt\n", "-r missing.txt\n"],
+        "b.txt": ["bar==1.2.3\n", "baz==1.2.3 --hash=md5:abc\n", "qux==1.2.3\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    result = pip_api.iter_requirements("a.txt", workers=workers)
+
+    # Errors are raised when they are reached, even if they happen first
+    assert [str(next(result)) for _ in range(2)] == ["foo==1.2.3", "bar==1.2.3"]
+    with pytest.raises(PipError, match="Invalid --hash kind md5"):
+        next(result)
+
+
+def _parse_cache_files():
+    directory = os.path.join(os.environ["PIPAPI_CACHE_DIR"], "requirements")
+    return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+def test_parse_requirements_cache(monkeypatch):
+    files = {
+        "a.txt": [
+            "foo[b,a]>=1.2.3,<2 --hash=sha256:abc\n",
+            "bar @ https://example.com/bar-1.0.tar.gz\n",
+            "baz==1.2.3 ; python_version < '3'\n",
+            "qux==1.2.3 ; python_version >= '3'\n",
+            "-r b.txt\n",
+        ],
+        "b.txt": ["quux==1.2.3\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    expected = pip_api.parse_requirements("a.txt", cache=True)
+    assert len(_parse_cache_files()) == 2
+
+    # Cached requirements are rebuilt without going through the grammar
+    grammar_used = pretend.raiser(AssertionError("grammar was used"))
+    monkeypatch.setattr(pip_api._parse_requirements, "_tokenize", grammar_used)
+    monkeypatch.setattr(
+        pip_api._parse_requirements.requirements.Requirement,
+        "__init__",
+        grammar_used,
+    )
+
+    result = pip_api.parse_requirements("a.txt", cache=True)
+
+    assert list(result) == ["foo", "bar", "qux", "quux"]
+    for name, req in result.items():
+        assert type(req) is pip_api.Requirement
+        for attribute in [
+            "name",
+            "url",
+            "extras",
+            "specifier",
+            "marker",
+            "hashes",
+            "editable",
+            "filename",
+            "lineno",
+            "comes_from",
+        ]:
+            assert getattr(req, attribute) == getattr(expected[name], attribute)
+        assert str(req) == str(expected[name])
+
+
+def test_parse_requirements_cache_relative_includes(monkeypatch):
+    files = {
+        os.path.join("x", "a.txt"): ["-r b.txt\n"],
+        os.path.join("x", "b.txt"): ["foo==1.2.3\n"],
+        os.path.join("y", "a.txt"): ["-r b.txt\n"],
+        os.path.join("y", "b.txt"): ["bar==1.2.3\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    pip_api.parse_requirements(os.path.join("x", "a.txt"), cache=True)
+    result = pip_api.parse_requirements(os.path.join("y", "a.txt"), cache=True)
+
+    assert set(result) == {"bar"}
+    assert result["bar"].filename == os.path.join("y", "b.txt")
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "-e git+https://github.com/foo/deal.git#egg=deal\n",
+        "./foo\n",
+        "foo-1.0.tar.gz\n",
+        "file:///foo/bar.zip#egg=bar\n",
+    ],
+)
+def test_parse_requirements_cache_local(monkeypatch, line):
+    files = {"a.txt": ["foo==1.2.3\n", line]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    # Parsing these depends on more than the contents of the file
+    pip_api.parse_requirements("a.txt", include_invalid=True, cache=True)
+
+    assert _parse_cache_files() == []
+
+
+def test_parse_requirements_cache_options(monkeypatch):
+    files = {"a.txt": ["foo==1.2.3\n", "bar==1.2.3\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    pip_api.parse_requirements("a.txt", cache=True)
+    result = pip_api.parse_requirements(
+        "a.txt", options=pretend.stub(skip_requirements_regex="foo"), cache=True
+    )
+
+    assert set(result) == {"bar"}
+
+
+def test_parse_requirements_cache_eviction(monkeypatch):
+    files = {name: [name[0] + "==1.0\n"] for name in ["a.txt", "b.txt", "c.txt"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+    monkeypatch.setattr(pip_api._parse_requirements, "PARSE_CACHE_MAX_ENTRIES", 2)
+
+    def cache_path(name):
+        cache_name = pip_api._parse_requirements._cache_name("".join(files[name]), None)
+        return os.path.join(os.environ["PIPAPI_CACHE_DIR"], cache_name)
+
+    def parse(name, age=None):
+        pip_api.parse_requirements(name, cache=True)
+        if age is not None:
+            mtime = time.time() - age
+            os.utime(cache_path(name), (mtime, mtime))
+
+    parse("a.txt", age=20000)
+    parse("b.txt", age=10000)
+
+    # Using a.txt's cached entry again makes b.txt's the least recently used
+    parse("a.txt")
+    parse("c.txt")
+
+    assert sorted(_parse_cache_files()) == sorted(
+        os.path.basename(cache_path(name)) for name in ["a.txt", "c.txt"]
+    )
+
+
+def test_requirements_document(monkeypatch):
+    files = {
+        "a.txt": ["foo==1.2.3\n", "-r b.txt\n", "bar==1.2.3\n"],
+        "b.txt": ["baz==1.2.3\n"],
+        "c.txt": ["qux==1.2.3\n"],
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    document = pip_api.RequirementsDocument("a.txt")
+
+    assert document.files == ["a.txt", "b.txt"]
+    assert {name: str(req) for name, req in document.requirements.items()} == {
+        "foo": "foo==1.2.3",
+        "baz": "baz==1.2.3",
+        "bar": "bar==1.2.3",
+    }
+
+    parsed = []
+    parse_line = pip_api._parse_requirements._parse_line
+
+    def record_parse_line(filename, lineno, line, include_invalid=False):
+        parsed.append(line)
+        return parse_line(filename, lineno, line, include_invalid)
+
+    monkeypatch.setattr(pip_api._parse_requirements, "_parse_line", record_parse_line)
+
+    files["a.txt"] = ["# new\n", "foo==2.0\n", "-r c.txt\n", "bar==1.2.3\n"]
+    diff = document.update("a.txt")
+
+    # Only the lines which changed, and the newly included file, are parsed
+    assert parsed == ["foo==2.0", "-r c.txt", "qux==1.2.3"]
+    assert list(diff.added) == ["qux"]
+    assert list(diff.removed) == ["baz"]
+    assert [(str(old), str(new)) for old, new in diff.changed.values()] == [
+        ("foo==1.2.3", "foo==2.0")
+    ]
+    assert document.files == ["a.txt", "c.txt"]
+    assert document.requirements["bar"].lineno == 4
+    assert document.requirements["bar"].comes_from == "-r a.txt (line 4)"
+    assert document.requirements["bar"].hashes == {}
+
+
+def test_requirements_document_unchanged(monkeypatch):
+    files = {"a.txt": ["foo==1.2.3\n"], "b.txt": ["bar==1.2.3\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    document = pip_api.RequirementsDocument("a.txt")
+
+    assert not document.update("a.txt")
+    assert not document.update("b.txt")
+
+
+def test_requirements_document_error(monkeypatch):
+    files = {"a.txt": ["foo==1.2.3\n"]}
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.__getitem__)
+
+    document = pip_api.RequirementsDocument("a.txt")
+
+    files["a.txt"] = ["foo==1.2.3\n", "foo==3.2.1\n"]
+    with pytest.raises(PipError, match="Double requirement given"):
+        document.update("a.txt")
+
+    # The document is left as it was
+    assert str(document.requirements["foo"]) == "foo==1.2.3"
+
+    files["a.txt"] = ["foo==3.2.1\n"]
+    assert list(document.update("a.txt").changed) == ["foo"]
+
+
+def test_requirement_memoized(monkeypatch):
+    parse = pip_api._parse_requirements._parse_requirement_string
+    parse.cache_clear()
+
+    first = pip_api.Requirement(
+        "foo[bar]>=1.0 ; python_version >= '3'", filename="a.txt", lineno=1
+    )
+    second = pip_api.Requirement(
+        "foo[bar]>=1.0 ; python_version >= '3'",
+        hashes={"sha256": ["abc"]},
+        filename="b.txt",
+        lineno=2,
+    )
+
+    assert parse.cache_info().hits == 1
+    assert str(first) == str(second) == 'foo[bar]>=1.0; python_version >= "3"'
+    assert (first.filename, first.lineno, first.hashes) == ("a.txt", 1, None)
+    assert (second.filename, second.lineno, second.hashes) == (
+        "b.txt",
+        2,
+        {"sha256": ["abc"]},
+    )
+
+    # Mutating one requirement doesn't affect the other
+    first.extras.add("baz")
+    first.specifier.prereleases = True
+    assert second.extras == {"bar"}
+    assert second.specifier.prereleases is None
+
+
+def test_requirement_memoized_invalid():
+    with pytest.raises(pip_api._parse_requirements.requirements.InvalidRequirement):
+        pip_api.Requirement("foo==", filename="a.txt", lineno=1)
+
+
+def test_parse_requirements_markers_memoized(monkeypatch):
+    files = {
+        "a.txt": [
+            "foo==1.2.3 ; python_version < '3'\n",
+            "bar==1.2.3 ; python_version < '3'\n",
+            "baz==1.2.3 ; python_version >= '3'\n",
+            "qux==1.2.3 ; python_version >= '3'\n",
+        ]
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    pip_api._parse_requirements._evaluate_marker_string.cache_clear()
+    marker_class = pip_api._parse_requirements.markers.Marker
+    evaluate = pretend.call_recorder(marker_class.evaluate)
+    monkeypatch.setattr(marker_class, "evaluate", evaluate)
+
+    result = pip_api.parse_requirements("a.txt")
+
+    assert set(result) == {"baz", "qux"}
+    assert len(evaluate.calls) == 2
+
+
+def test_parse_requirements_environment(monkeypatch):
+    files = {
+        "a.txt": [
+            "foo==1.2.3 ; python_version < '3.10'\n",
+            "foo==3.2.1 ; python_version >= '3.10'\n",
+            "bar==1.2.3 ; sys_platform == 'win32'\n",
+        ]
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    result = pip_api.parse_requirements(
+        "a.txt", environment={"python_version": "3.9", "sys_platform": "win32"}
+    )
+
+    assert {name: str(req) for name, req in result.items()} == {
+        "foo": 'foo==1.2.3; python_version < "3.10"',
+        "bar": 'bar==1.2.3; sys_platform == "win32"',
+    }
+
+
+def test_parse_requirements_for_environments(monkeypatch):
+    files = {
+        "a.txt": [
+            "foo==1.2.3 ; python_version < '3.10'\n",
+            "foo==3.2.1 ; python_version >= '3.10'\n",
+            "bar==1.2.3 ; sys_platform == 'win32'\n",
+            "baz==1.2.3\n",
+        ]
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+    environments = [
+        {"python_version": "3.9", "sys_platform": "linux"},
+        {"python_version": "3.12", "sys_platform": "win32"},
+        {},
+    ]
+
+    current = pip_api.parse_requirements("a.txt")
+
+    pip_api._parse_requirements._evaluate_marker_string.cache_clear()
+    result = pip_api.parse_requirements_for_environments("a.txt", environments)
+
+    # Each marker is evaluated in all of the environments at once
+    assert pip_api._parse_requirements._evaluate_marker_string.cache_info().misses == 3
+    assert [{name: str(req.specifier) for name, req in r.items()} for r in result] == [
+        {"foo": "==1.2.3", "baz": "==1.2.3"},
+        {"foo": "==3.2.1", "bar": "==1.2.3", "baz": "==1.2.3"},
+        {name: str(req.specifier) for name, req in current.items()},
+    ]
+
+
+def test_parse_requirements_for_environments_double_raises(monkeypatch):
+    files = {
+        "a.txt": [
+            "foo==1.2.3 ; python_version < '3.10'\n",
+            "foo==3.2.1 ; python_version >= '3.9'\n",
+        ]
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    pip_api.parse_requirements_for_environments("a.txt", [{"python_version": "3.8"}])
+    with pytest.raises(PipError, match="Double requirement given"):
+        pip_api.parse_requirements_for_environments(
+            "a.txt", [{"python_version": "3.8"}, {"python_version": "3.9"}]
+        )
+
+
+@pytest.mark.parametrize(
+    "pyproject_toml",
+    [
+        '[build-system]\nrequires = ["x"]\n\n[project]\nname = "foo"\n\n[tool.x]\ny = 1\n',
+        '  [ project ]  # comment\nname = "foo"\n',
+        'project = {name = "foo"}\n',
+        'project.name = "foo"\n',
+        '[project]\nname = "foo"\ndescription = """\n[not.a.table]\n"""\n',
+    ],
+)
+def test_project_table(pyproject_toml):
+    result = pip_api._parse_requirements._project_table(pyproject_toml)
+
+    assert result["name"] == "foo"
+
+
+def test_project_table_only_parses_project(monkeypatch):
+    # Other tables are never parsed, so errors in them don't matter
+    pyproject_toml = '[project]\nname = "foo"\n\n[tool.x]\ny = \n'
+
+    result = pip_api._parse_requirements._project_table(pyproject_toml)
+
+    assert result == {"name": "foo"}
+
+
+def test_parse_local_package_name_memoized(monkeypatch, tmpdir):
+    path = str(tmpdir)
+    pyproject_toml = os.path.join(path, "pyproject.toml")
+    with open(pyproject_toml, "w") as f:
+        f.write('[project]\nname = "foo"\n')
+
+    loads = pretend.call_recorder(pip_api._parse_requirements.tomli.loads)
+    monkeypatch.setattr(pip_api._parse_requirements.tomli, "loads", loads)
+
+    assert pip_api._parse_requirements._parse_local_package_name(path) == "foo"
+    assert pip_api._parse_requirements._parse_local_package_name(path) == "foo"
+    assert len(loads.calls) == 1
+
+    with open(pyproject_toml, "w") as f:
+        f.write('[project]\nname = "foobar"\n')
+
+    assert pip_api._parse_requirements._parse_local_package_name(path) == "foobar"
+    assert len(loads.calls) == 2
+
+
+def test_parse_local_package_name_bounded(monkeypatch, tmpdir):
+    monkeypatch.setattr(
+        pip_api._parse_requirements,
+        "_local_package_names",
+        pip_api._cache.LRUCache(max_entries=2),
+    )
+    for name in ["a", "b", "c"]:
+        tmpdir.mkdir(name).join("pyproject.toml").write(
+            '[project]\nname = "{}"\n'.format(name)
+        )
+        path = str(tmpdir.join(name))
+        assert pip_api._parse_requirements._parse_local_package_name(path) == name
+
+    assert len(pip_api._parse_requirements._local_package_names) == 2
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_parse_requirements_stat_cache(monkeypatch, data, workers):
+    lines = [
+        f"-e {data.join('dummyproject_pyproject')}\n",
+        f"{data.join('dummyproject')}\n",
+        f"{data.join('dummyproject-0.0.1-py3-none-any.whl')}\n",
+    ]
+    files = {
+        "a.txt": lines + ["-r b.txt\n", "-r c.txt\n"],
+        "b.txt": lines,
+        "c.txt": lines,
+    }
+    monkeypatch.setattr(pip_api._parse_requirements, "_read_file", files.get)
+
+    stats = []
+    stat = os.stat
+
+    def record_stat(path, *args, **kwargs):
+        stats.append(os.fspath(path))
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", record_stat)
+
+    result = list(
+        pip_api.iter_requirements("a.txt", include_invalid=True, workers=workers)
+    )
+
+    assert len(result) == 9
+    assert stats
+    assert sorted(stats) == sorted(set(stats))
+    # The cache only lasts as long as the parse
+    assert pip_api._parse_requirements._stat_cache.get() is None
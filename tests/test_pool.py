@@ -0,0 +1,262 @@
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import pip_api
+import pip_api.aio
+from pip_api import _call, _pool
+from pip_api.exceptions import QueueFull
+
+
+@pytest.fixture
+def call_pool():
+    def set_pool(*args, **kwargs):
+        pool = pip_api.CallPool(*args, **kwargs)
+        pip_api.set_call_pool(pool)
+        return pool
+
+    previous = _pool.get_call_pool()
+    yield set_pool
+    pip_api.set_call_pool(previous)
+
+
+def _wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_import_does_not_import_asyncio():
+    # Only pip_api.aio needs asyncio, which is slow to import
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-c",
+            "import sys, pip_api; assert 'asyncio' not in sys.modules",
+        ]
+    )
+
+
+def test_call_pool_limits_concurrency(call_pool, monkeypatch):
+    pool = call_pool(max_concurrency=2)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def check_output(*args, **kwargs):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return b""
+
+    monkeypatch.setattr(_call, "check_output", check_output)
+
+    threads = [threading.Thread(target=_call.call, args=("list",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    metrics = pool.metrics()
+    assert metrics["running"] == 0
+    assert metrics["queued"] == 0
+    assert metrics["calls"] == 8
+    assert metrics["queue_depth_max"] > 0
+    assert metrics["wait_time_max"] > 0
+
+
+def test_call_pool_priority():
+    pool = pip_api.CallPool(max_concurrency=1)
+    pool.acquire()
+
+    order = []
+
+    def wait(name, priority):
+        pool.acquire(priority)
+        order.append(name)
+        pool.release()
+
+    threads = []
+    for name, priority in [("low", 0), ("high", 10), ("low-2", 0), ("mid", 5)]:
+        thread = threading.Thread(target=wait, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: pool.metrics()["queued"] == len(threads))
+
+    pool.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == ["high", "mid", "low", "low-2"]
+
+
+def test_call_pool_max_queue():
+    pool = pip_api.CallPool(max_concurrency=1, max_queue=1)
+    pool.acquire()
+
+    thread = threading.Thread(target=pool.acquire)
+    thread.start()
+    _wait_for(lambda: pool.metrics()["queued"] == 1)
+
+    with pytest.raises(QueueFull):
+        pool.acquire()
+
+    pool.release()
+    thread.join()
+    pool.release()
+
+    assert pool.metrics()["rejected"] == 1
+    assert pool.metrics()["running"] == 0
+
+
+def test_call_pool_max_wait():
+    pool = pip_api.CallPool(max_concurrency=1, max_wait=0.01)
+    pool.acquire()
+
+    with pytest.raises(QueueFull):
+        pool.acquire()
+
+    # The timed out call no longer holds a place in the queue
+    assert pool.metrics()["queued"] == 0
+    pool.release()
+    pool.acquire()
+    pool.release()
+
+    assert pool.metrics()["running"] == 0
+    assert pool.metrics()["rejected"] == 1
+
+
+def test_set_call_pool():
+    pool = pip_api.CallPool(max_concurrency=3)
+    previous = pip_api.set_call_pool(pool)
+    try:
+        assert _pool.get_call_pool() is pool
+        assert repr(pool) == (
+            "<CallPool(max_concurrency=3, max_queue=None, max_wait=None)>"
+        )
+    finally:
+        assert pip_api.set_call_pool(previous) is pool
+
+
+def test_call_priority(call_pool, monkeypatch):
+    pool = call_pool(max_concurrency=1)
+    priorities = []
+    acquire = pool.acquire
+    monkeypatch.setattr(
+        pool, "acquire", lambda priority=0: priorities.append(priority) or acquire()
+    )
+    monkeypatch.setattr(_call, "check_output", lambda *args, **kwargs: b"")
+
+    _call.call("list")
+    with pip_api.call_priority(7):
+        _call.call("list")
+    _call.call("list")
+
+    assert priorities == [0, 7, 0]
+
+
+def test_aio_call_pool(call_pool, pip):
+    pool = call_pool(max_concurrency=1)
+
+    async def main():
+        return await asyncio.gather(
+            pip_api.aio.call("--version"), pip_api.aio.call("--version")
+        )
+
+    results = asyncio.run(main())
+
+    assert results == [pip.run("--version")] * 2
+    assert pool.metrics()["calls"] == 2
+    assert pool.metrics()["running"] == 0
+
+
+def test_aio_call_pool_cancelled(call_pool):
+    pool = call_pool(max_concurrency=1)
+    pool.acquire()
+
+    async def cancel_call():
+        task = asyncio.ensure_future(pip_api.aio.call("--version"))
+        while not pool.metrics()["queued"]:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_call())
+
+    # The cancelled call gives up its place in the queue
+    assert pool.metrics()["queued"] == 0
+    pool.release()
+    assert pool.metrics()["running"] == 0
+    assert pool.metrics()["calls"] == 1
+
+
+def test_aio_call_pool_cancelled_after_handoff():
+    pool = pip_api.CallPool(max_concurrency=1)
+    pool.acquire()
+
+    async def cancel_acquire():
+        task = asyncio.ensure_future(pool.acquire_async())
+        while not pool.metrics()["queued"]:
+            await asyncio.sleep(0)
+        # Hand the slot over, but cancel before the waiter can run
+        pool.release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_acquire())
+
+    # The slot handed to the cancelled call is given back
+    assert pool.metrics()["running"] == 0
+
+
+def test_aio_call_pool_waiters_use_no_threads():
+    pool = pip_api.CallPool(max_concurrency=1)
+    pool.acquire()
+    threads = threading.active_count()
+    order = []
+
+    async def wait(name, priority):
+        await pool.acquire_async(priority)
+        order.append(name)
+        pool.release()
+
+    async def main():
+        tasks = [asyncio.ensure_future(wait(i, i % 3)) for i in range(100)]
+        while pool.metrics()["queued"] < len(tasks):
+            await asyncio.sleep(0.001)
+        assert threading.active_count() == threads
+
+        # Release from another thread, as a finished synchronous call would
+        threading.Thread(target=pool.release).start()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+    assert order == (
+        list(range(2, 100, 3)) + list(range(1, 100, 3)) + list(range(0, 100, 3))
+    )
+    assert pool.metrics()["running"] == 0
+
+
+def test_aio_call_pool_max_wait():
+    pool = pip_api.CallPool(max_concurrency=1, max_wait=0.01)
+    pool.acquire()
+
+    with pytest.raises(QueueFull):
+        asyncio.run(pool.acquire_async())
+
+    assert pool.metrics()["queued"] == 0
+    assert pool.metrics()["rejected"] == 1
+    assert pool.metrics()["wait_time_max"] == 0
+    pool.release()
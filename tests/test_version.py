@@ -1,3 +1,9 @@
+import subprocess
+import sys
+
+import pretend
+import pytest
+
 import pip_api
 
 
@@ -7,3 +13,107 @@ def test_version(pip):
     from_import = str(pip_api.PIP_VERSION)
 
     assert from_api == from_call == from_import
+
+
+def test_import_does_not_call_pip():
+    # Importing pip_api should not compute PIP_VERSION, which requires calling
+    # out to pip
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-c",
+            "import pip_api; assert 'PIP_VERSION' not in vars(pip_api)",
+        ]
+    )
+
+
+def test_pip_version_is_memoized(monkeypatch):
+    calls = []
+
+    def fake_version(timeout=None):
+        calls.append(None)
+        return "1.2.3"
+
+    monkeypatch.delattr(pip_api, "PIP_VERSION", raising=False)
+    monkeypatch.setattr(pip_api, "version", fake_version)
+
+    assert str(pip_api.PIP_VERSION) == "1.2.3"
+    assert str(pip_api.PIP_VERSION) == "1.2.3"
+    assert len(calls) == 1
+
+    # Don't leak the fake version into other tests
+    del pip_api.PIP_VERSION
+
+
+@pytest.fixture
+def fake_pip(monkeypatch, tmpdir):
+    """
+    Point pip_api at a fake interpreter whose pip lives in a temporary
+    site-packages directory, and count the calls made to it.
+    """
+    site_packages = tmpdir.mkdir("site-packages")
+    location = site_packages.mkdir("pip")
+    location.join("__init__.py").write("")
+    site_packages.mkdir("pip-1.0.dist-info").join("METADATA").write("Version: 1.0\n")
+
+    calls = []
+
+    def fake_call(*args, cwd=None, timeout=None):
+        calls.append(args)
+        return "pip 1.0 from {} (python 3.x)\n".format(location)
+
+    monkeypatch.setenv("PIPAPI_PYTHON_LOCATION", str(tmpdir.join("python")))
+    monkeypatch.setattr(pip_api._version, "call", fake_call)
+
+    return pretend.stub(location=location, calls=calls)
+
+
+def test_version_is_cached(fake_pip):
+    assert pip_api.version() == "1.0"
+    assert pip_api.version() == "1.0"
+    assert len(fake_pip.calls) == 1
+
+
+def test_version_cache_upgraded_in_place(fake_pip, tmpdir):
+    assert pip_api.version() == "1.0"
+
+    # Upgrading pip in place rewrites it, so the version should be re-read
+    # from its metadata without calling pip
+    site_packages = tmpdir.join("site-packages")
+    site_packages.join("pip-1.0.dist-info").remove()
+    site_packages.mkdir("pip-2.0.dist-info").join("METADATA").write("Version: 2.0\n")
+    fake_pip.location.join("__init__.py").write("# upgraded")
+
+    assert pip_api.version() == "2.0"
+    assert pip_api.version() == "2.0"
+    assert len(fake_pip.calls) == 1
+
+
+def test_version_cache_invalidated_by_removal(fake_pip):
+    assert pip_api.version() == "1.0"
+
+    fake_pip.location.join("__init__.py").remove()
+
+    assert pip_api.version() == "1.0"
+    assert len(fake_pip.calls) == 2
+
+
+def test_version_current_interpreter(monkeypatch):
+    monkeypatch.delenv("PIPAPI_PYTHON_LOCATION", raising=False)
+    expected = subprocess.check_output(
+        [sys.executable, "-m", "pip", "--version"]
+    ).decode()
+
+    # The version of pip in the current interpreter shouldn't require calling
+    # out to pip at all
+    monkeypatch.setattr(pip_api._version, "call", pretend.raiser(AssertionError))
+
+    assert pip_api.version() == expected.split(" ")[1]
+
+
+def test_version_cache_disabled(monkeypatch, fake_pip):
+    monkeypatch.setenv("PIPAPI_NO_CACHE_DIR", "1")
+
+    assert pip_api.version() == "1.0"
+    assert pip_api.version() == "1.0"
+    assert len(fake_pip.calls) == 2